@@ -1,14 +1,32 @@
+import functools
 import logging
 import pathlib
 
-import pkg_resources
+from mopidy import config, exceptions, ext
 
-from mopidy import config, ext
+try:
+    from importlib import metadata
+except ImportError:  # Python < 3.8
+    import importlib_metadata as metadata
 
-__version__ = pkg_resources.get_distribution("mopidy_pidi").version
+__version__ = metadata.version("mopidy_pidi")
 
 logger = logging.getLogger(__name__)
 
+DISPLAY_ENTRY_POINT = "pidi.plugin.display"
+
+
+@functools.lru_cache(maxsize=None)
+def get_display_entry_points():
+    """Return display plugin entry points by name, without loading them."""
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        entry_points = entry_points.select(group=DISPLAY_ENTRY_POINT)
+    else:  # Python < 3.10
+        entry_points = entry_points.get(DISPLAY_ENTRY_POINT, [])
+
+    return {entry_point.name: entry_point for entry_point in entry_points}
+
 
 class Extension(ext.Extension):
 
@@ -17,29 +35,74 @@ class Extension(ext.Extension):
     version = __version__
 
     @classmethod
+    @functools.lru_cache(maxsize=None)
     def get_display_types(self):
         display_types = {}
-        for entry_point in pkg_resources.iter_entry_points("pidi.plugin.display"):
-            try:
-                plugin = entry_point.load()
+        for entry_point in get_display_entry_points().values():
+            plugin = self._load_display(entry_point)
+            if plugin is not None:
                 display_types[plugin.option_name] = plugin
-            except (ImportError) as err:
-                logger.log(
-                    logging.WARN, f"Error loading display plugin {entry_point}: {err}"
-                )
 
         return display_types
 
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def get_display_class(cls, name):
+        """Load only the display plugin selected by name."""
+        entry_point = get_display_entry_points().get(name)
+        if entry_point is not None:
+            plugin = cls._load_display(entry_point)
+            if plugin is not None and plugin.option_name == name:
+                return plugin
+
+        # Fall back to matching the option name of every plugin, in case it
+        # differs from the name the plugin registered its entry point under
+        display_types = cls.get_display_types()
+        if name not in display_types:
+            message = (
+                f"Unknown display plugin {name}, "
+                f"choose from: {', '.join(sorted(display_types))}"
+            )
+            logger.error(message)
+            raise exceptions.ExtensionError(message)
+        return display_types[name]
+
+    @classmethod
+    def _load_display(cls, entry_point):
+        try:
+            return entry_point.load()
+        except (ImportError) as err:
+            logger.log(
+                logging.WARN, f"Error loading display plugin {entry_point}: {err}"
+            )
+            return None
+
     def get_default_config(self):
         return config.read(pathlib.Path(__file__).parent / "ext.conf")
 
     def get_config_schema(self):
         schema = super().get_config_schema()
-        schema["display"] = config.String(choices=self.get_display_types().keys())
+        # Validated by get_display_class, so that listing the choices here
+        # doesn't mean importing every installed display plugin at startup.
+        schema["display"] = config.String()
         schema["rotation"] = config.Integer(choices=[0, 90, 180, 270])
         schema["idle_timeout"] = config.Integer(minimum=0)
+        schema["min_fps"] = config.Float(minimum=0.01)
+        schema["max_fps"] = config.Float(minimum=1)
+        schema["cache_max_mb"] = config.Integer(minimum=0)
+        schema["cache_max_entries"] = config.Integer(minimum=0)
+        schema["prefetch"] = config.Integer(minimum=0)
+        schema["cache_miss_ttl"] = config.Integer(minimum=0)
+        schema["shared_cache_dir"] = config.Path(optional=True)
+        schema["metrics_interval"] = config.Integer(minimum=0)
+        schema["metrics_file"] = config.Path(optional=True)
         return schema
 
+    def get_command(self):
+        from .commands import PiDiCommand
+
+        return PiDiCommand()
+
     def setup(self, registry):
         from .frontend import PiDiFrontend
 
@@ -2,121 +2,485 @@
 Musicbrainz related functions.
 """
 import base64
+import hashlib
 import logging
 import os
+import threading
 import time
-from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
 
 import musicbrainzngs as mus
+import requests
 
 from .__init__ import __version__
+from . import image, local, metrics
+from .cache import ArtCache, is_complete, write_file
 
 logger = logging.getLogger(__name__)
 
+cache_hits = metrics.registry.counter(
+    "pidi_art_cache_hits_total", "Album art lookups answered by the cache"
+)
+cache_misses = metrics.registry.counter(
+    "pidi_art_cache_misses_total", "Album art lookups that had to fetch art"
+)
+musicbrainz_request_seconds = metrics.registry.histogram(
+    "pidi_musicbrainz_request_seconds",
+    "Time taken by each MusicBrainz search and cover art download",
+)
+musicbrainz_retries = metrics.registry.counter(
+    "pidi_musicbrainz_retries_total", "MusicBrainz requests retried after an error"
+)
+musicbrainz_not_found = metrics.registry.counter(
+    "pidi_musicbrainz_not_found_total", "MusicBrainz lookups which found no art"
+)
+musicbrainz_failures = metrics.registry.counter(
+    "pidi_musicbrainz_failures_total", "MusicBrainz lookups which ran out of retries"
+)
+download_bytes = metrics.registry.counter(
+    "pidi_art_download_bytes_total", "Bytes of album art downloaded from URLs"
+)
+download_seconds = metrics.registry.histogram(
+    "pidi_art_download_seconds", "Time taken by each album art download"
+)
+
+
+class RateLimiter:
+    """Token bucket allowing rate requests a second, in bursts of up to burst."""
+
+    def __init__(self, rate=1.0, burst=1):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._last_update = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be made."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self._burst, self._tokens + (now - self._last_update) * self._rate
+            )
+            self._last_update = now
+            # Take the token now, even if that means borrowing against the
+            # future, so that waiting callers are served in order.
+            self._tokens -= 1
+            delay = -self._tokens / self._rate if self._tokens < 0 else 0
+
+        if delay > 0:
+            time.sleep(delay)
+
 
 class Brainz:
-    def __init__(self, cache_dir):
-        """Initialize musicbrainz."""
+    # Album art lookups are network bound, but MusicBrainz rate limits
+    # clients so there is nothing to gain from a large pool.
+    max_workers = 2
+
+    # Connect and read timeouts in seconds for album art downloads
+    http_timeout = (5, 10)
+
+    # Shared by every lookup, to stay within the MusicBrainz rate limit of
+    # one request a second per client.
+    rate_limiter = RateLimiter(rate=1.0)
+
+    # Seconds before an album with no art is looked up again
+    miss_ttl = 24 * 60 * 60
+
+    # Seconds between checks for expired misses to look up again
+    revalidate_interval = 10 * 60
+
+    # Seconds between saves of the art cache index, if it has changed
+    flush_interval = 60
+
+    def __init__(
+        self,
+        cache_dir,
+        cache=None,
+        art_size=None,
+        art_blur=False,
+        miss_ttl=None,
+        max_workers=None,
+    ):
+        """Initialize musicbrainz.
+
+        If art_size is given, and Pillow is available, album art is stored
+        resized (and optionally blurred) for a display of that size.
+
+        """
         mus.set_useragent(
             "python-pidi: A cover art daemon.",
             __version__,
             "https://github.com/pimoroni/mopidy-pidi",
         )
+        # Requests are limited by Brainz.rate_limiter instead
+        mus.set_rate_limit(False)
 
         self._cache_dir = cache_dir
-        self._default_filename = os.path.join(self._cache_dir, "__default.jpg")
+        self._cache = cache if cache is not None else ArtCache(cache_dir)
+        self._art_size = art_size if image.available() else None
+        self._art_blur = art_blur
+        if miss_ttl is not None:
+            self.miss_ttl = miss_ttl
+        if max_workers is not None:
+            self.max_workers = max_workers
+        self._thumbnail_size = image.get_thumbnail_size(art_size or 500)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="pidi-art"
+        )
+        # MusicBrainz lookups back off for up to half a minute when the
+        # network is down, so they don't get to hold up the other workers
+        self._musicbrainz_executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="pidi-musicbrainz"
+        )
+        self._prefetch_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="pidi-prefetch"
+        )
+        self._in_flight = {}
+        self._prefetching = set()
+        self._session = requests.Session()
+        # Re-entrant since a future that has already finished runs its
+        # done callback, and so _release_in_flight, immediately.
+        self._in_flight_lock = threading.RLock()
+
+        self._default_filename = self._save_default_album_art()
 
-        self.save_album_art(self.get_default_album_art(), self._default_filename)
+        self._stopped = threading.Event()
+        self._revalidate_thread = threading.Thread(
+            target=self._revalidate_loop, name="pidi-revalidate", daemon=True
+        )
+        self._revalidate_thread.start()
 
-    def get_album_art(self, artist, album, callback=None):
+    def get_album_art(self, artist, album, callback=None, prefetch=False):
         if artist is None or album is None or artist == "" or album == "":
             if callback is not None:
                 return callback(self._default_filename)
             return self._default_filename
 
-        file_name = self.get_cache_file_name(f"{artist}_{album}")
+        key = self._get_variant_key(f"{artist}_{album}")
+        if self._cache.is_miss(key):
+            # Recently looked up and there was no art to be found
+            if callback is not None:
+                return callback(self._default_filename)
+            return self._default_filename
+
+        return self._get(
+            key,
+            self._fetch_album_art,
+            (artist, album),
+            callback,
+            prefetch,
+            executor=self._musicbrainz_executor,
+            default=self._default_filename,
+        )
+
+    def get_url_art(self, url, callback=None, prefetch=False):
+        """Download album art from an http(s) URL into the cache.
+
+        Resolves to the cached file name, or None if the download failed.
+
+        """
+        key = self._get_variant_key(url)
+        return self._get(key, self._fetch_url_art, (url,), callback, prefetch)
+
+    def get_file_art(self, path, callback=None, prefetch=False):
+        """Return a display-ready copy of album art from a local file.
+
+        path may be an image, or an audio file with art in its tags.
+        Resolves to None if an audio file has no art that can be read.
+
+        """
+        if self._art_size is None and local.is_image_file(path):
+            # No need for a copy when the art is used as-is
+            if callback is not None:
+                return callback(path)
+            return path
+
+        key = self._get_variant_key(path)
+        return self._get(key, self._fetch_file_art, (path,), callback, prefetch)
+
+    def is_default_art(self, file_name):
+        """Return True if file_name is the art used when there is none."""
+        return file_name == self._default_filename
+
+    def submit(self, fn, *args, prefetch=False):
+        """Run fn in a worker pool, for work leading up to a lookup."""
+        executor = self._prefetch_executor if prefetch else self._executor
+        return executor.submit(fn, *args)
+
+    def cancel(self, future):
+        """Cancel a lookup that is still queued behind others in the pool.
+
+        Lookups which are already running can't be cancelled, they are left
+        to complete and cache their result.
+
+        """
+        return future.cancel()
+
+    def shutdown(self):
+        """Stop accepting lookups and abandon any that are still queued."""
+        self._stopped.set()
+        self._executor.shutdown(wait=False)
+        self._musicbrainz_executor.shutdown(wait=False)
+        self._prefetch_executor.shutdown(wait=False)
+        self._session.close()
+        self._cache.close()
+
+    def revalidate_misses(self, limit=10):
+        """Look up albums again, at low priority, once their misses expire.
+
+        Does nothing while other lookups are in flight, so that retrying old
+        failures never competes with art that is wanted right now. Returns
+        the number of lookups queued.
+
+        """
+        with self._in_flight_lock:
+            if self._in_flight:
+                return 0
+
+        misses = self._cache.get_expired_misses()[:limit]
+        for key, (artist, album) in misses:
+            self._submit(key, self._fetch_album_art, artist, album, prefetch=True)
+
+        return len(misses)
 
-        if os.path.isfile(file_name):
+    def _revalidate_loop(self):
+        last_revalidate = time.monotonic()
+        while not self._stopped.wait(self.flush_interval):
+            self._cache.flush()
+            if time.monotonic() - last_revalidate >= self.revalidate_interval:
+                last_revalidate = time.monotonic()
+                self.revalidate_misses()
+
+    def _get(self, key, fn, args, callback, prefetch, executor=None, default=None):
+        """Return cached art for key, or look it up with fn(*args, key).
+
+        A prefetch is queued at low priority and never waited on, so it
+        returns its future even when there's no callback. A lookup that
+        fails with an error resolves to default.
+
+        """
+        file_name = self._cache.get(key)
+
+        if file_name is not None:
             # If a cached file already exists, use it!
+            cache_hits.inc()
             if callback is not None:
                 return callback(file_name)
             return file_name
 
+        cache_misses.inc()
+        future = self._submit(key, fn, *args, prefetch=prefetch, executor=executor)
+        if prefetch and callback is None:
+            return future
+        return self._resolve(future, callback, default)
+
+    def _resolve(self, future, callback, default=None):
+        def result(future):
+            file_name = future.result()
+            return default if file_name is None else file_name
+
         if callback is not None:
 
-            def async_request_album_art(self, artist, album, file_name, callback):
-                album_art = self.request_album_art(artist, album)
+            def done(future):
+                if not future.cancelled():
+                    callback(result(future))
 
-                if album_art is None:
-                    # If the MusicBrainz request fails, cache the default
-                    # art using this filename.
-                    self.save_album_art(self.get_default_album_art(), file_name)
-                    return callback(file_name)
+            future.add_done_callback(done)
+            return future
 
-                self.save_album_art(album_art, file_name)
+        return result(future)
 
-                return callback(file_name)
+    def _submit(self, key, fn, *args, prefetch=False, executor=None):
+        """Run fn in a worker pool, sharing one future per cache key.
 
-            t_album_art = Thread(
-                target=async_request_album_art,
-                args=(self, artist, album, file_name, callback),
-            )
-            t_album_art.start()
-            return t_album_art
+        Concurrent requests for the same cache key coalesce onto the
+        lookup already in flight rather than starting another. Prefetches
+        run one at a time in their own pool, and are moved to executor,
+        the main pool by default, if something needs their result before
+        they've started.
 
-        else:
-            album_art = self.request_album_art(artist, album)
+        """
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            if not prefetch and future in self._prefetching:
+                if future.cancel():
+                    # Still queued, promote it to the main pool
+                    future = None
 
-            if album_art is None:
-                # If the MusicBrainz request fails, cache the default
-                # art using this filename.
-                self.save_album_art(self.get_default_album_art(), file_name)
-                return file_name
+            if future is None:
+                if prefetch:
+                    executor = self._prefetch_executor
+                elif executor is None:
+                    executor = self._executor
+                future = executor.submit(self._fetch, key, fn, *args)
+                self._in_flight[key] = future
+                if prefetch:
+                    self._prefetching.add(future)
+                future.add_done_callback(lambda f: self._release_in_flight(key, f))
+            return future
+
+    def _fetch(self, key, fn, *args):
+        # Other Mopidy instances sharing the cache may be fetching the same
+        # art, in which case wait for them and use what they cached.
+        # Errors resolve to None, so that callers waiting on the lookup
+        # get to fall back to other art.
+        try:
+            with self._cache.lock(key):
+                file_name = self._cache.get(key)
+                if file_name is not None:
+                    return file_name
+                return fn(*args, key)
+        except Exception:
+            logger.exception(f"mopidy-pidi: unable to fetch album art for {key}")
+            return None
 
-            self.save_album_art(album_art, file_name)
+    def _release_in_flight(self, key, future):
+        with self._in_flight_lock:
+            self._prefetching.discard(future)
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
 
-            return file_name
+    def _get_variant_key(self, key):
+        """Return the cache key for art prepared for this display."""
+        if self._art_size is None:
+            return key
+        blur = "_blur" if self._art_blur else ""
+        return f"{key}@{self._art_size}{blur}"
 
-    def save_album_art(self, data, output_file):
-        with open(output_file, "wb") as f:
-            f.write(data)
+    def _prepare_album_art(self, data):
+        if self._art_size is None:
+            return data
+        return image.prepare_album_art(data, self._art_size, self._art_blur)
 
-    def request_album_art(self, artist, album, size=500, retry_delay=5, retries=5):
-        """Download the cover art."""
-        try:
-            data = mus.search_releases(artist=artist, release=album, limit=1)
-            release_id = data["release-list"][0]["release-group"]["id"]
-            logger.info("mopidy-pidi: musicbrainz using release-id: {release_id}")
+    def _save_default_album_art(self):
+        """Write the default art for this display, unless it already has been.
+
+        The file is named for a hash of the embedded image, and the variant
+        prepared from it, so it's only written again if either changes.
+
+        """
+        data = self.get_default_album_art()
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        name = self._get_variant_key(f"__default-{digest}")
+        # Prepared art is re-encoded as JPEG, otherwise it's left as PNG
+        extension = "png" if self._art_size is None else "jpg"
+        file_name = os.path.join(self._cache_dir, f"{name}.{extension}")
 
-            return mus.get_release_group_image_front(release_id, size=size)
+        if not is_complete(file_name):
+            self.save_album_art(self._prepare_album_art(data), file_name)
+            self._remove_old_default_album_art(file_name)
 
-        except mus.NetworkError:
-            if retries == 0:
-                # raise mus.NetworkError("Failure connecting to MusicBrainz.org")
+        return file_name
+
+    def _remove_old_default_album_art(self, keep):
+        """Remove default art for other displays and older versions."""
+        with os.scandir(self._cache_dir) as it:
+            for entry in it:
+                if entry.name.startswith("__default") and entry.path != keep:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+
+    def _fetch_album_art(self, artist, album, key):
+        album_art = self.request_album_art(artist, album, size=self._thumbnail_size)
+        if album_art is None:
+            # Use the default art for now, but try again once the miss
+            # has expired in case the failure was only temporary.
+            self._cache.add_miss(key, self.miss_ttl, source=(artist, album))
+            return self._default_filename
+        return self._cache.put(key, self._prepare_album_art(album_art))
+
+    def _fetch_file_art(self, path, key):
+        if not local.is_image_file(path):
+            album_art = local.read_embedded_art(path)
+            if album_art is None:
                 return None
+            return self._cache.put(key, self._prepare_album_art(album_art))
+
+        try:
+            with open(path, "rb") as f:
+                album_art = f.read()
+        except OSError as err:
+            logger.info(f"mopidy-pidi: failed to read album art {path}: {err}")
+            return path
+
+        return self._cache.put(key, self._prepare_album_art(album_art))
+
+    def _fetch_url_art(self, url, key):
+        try:
+            with download_seconds.time():
+                response = self._session.get(url, timeout=self.http_timeout)
+        except requests.RequestException as err:
+            logger.info(f"mopidy-pidi: failed to download album art {url}: {err}")
+            return None
+
+        if response.status_code != 200:
             logger.info(
-                f"mopidy-pidi: musicbrainz retrying download. {retries} retries left!"
+                f"mopidy-pidi: failed to download album art {url}: "
+                f"HTTP {response.status_code}"
             )
-            time.sleep(retry_delay)
-            self.request_album_art(artist, album, size=size, retries=retries - 1)
+            return None
+
+        download_bytes.inc(len(response.content))
+        return self._cache.put(key, self._prepare_album_art(response.content))
+
+    def save_album_art(self, data, output_file):
+        write_file(output_file, data)
 
-        except mus.ResponseError:
+    def request_album_art(self, artist, album, size=250, retry_delay=2, retries=4):
+        """Download the cover art, or return None if there is none.
+
+        Network errors, and MusicBrainz asking us to slow down, are retried
+        with an exponential backoff starting at retry_delay seconds.
+
+        """
+        for attempt in range(retries + 1):
+            try:
+                self.rate_limiter.acquire()
+                with musicbrainz_request_seconds.time():
+                    data = mus.search_releases(artist=artist, release=album, limit=1)
+                    release_id = data["release-list"][0]["release-group"]["id"]
+                    logger.info(
+                        f"mopidy-pidi: musicbrainz using release-id: {release_id}"
+                    )
+
+                    return mus.get_release_group_image_front(release_id, size=size)
+
+            except (IndexError, KeyError):
+                logger.info(
+                    f"mopidy-pidi: musicbrainz couldn't find a release for {artist} - {album}"
+                )
+                musicbrainz_not_found.inc()
+                return None
+
+            except mus.ResponseError as err:
+                # 503 is how MusicBrainz signals we are being rate limited
+                if getattr(err.cause, "code", None) != 503:
+                    logger.info(
+                        f"mopidy-pidi: musicbrainz couldn't find album art for {artist} - {album}"
+                    )
+                    musicbrainz_not_found.inc()
+                    return None
+
+            except mus.NetworkError:
+                pass
+
+            if attempt == retries:
+                musicbrainz_failures.inc()
+                return None
+
+            musicbrainz_retries.inc()
+            delay = retry_delay * 2**attempt
             logger.info(
-                f"mopidy-pidi: musicbrainz couldn't find album art for {artist} - {album}"
+                f"mopidy-pidi: musicbrainz retrying download in {delay}s. "
+                f"{retries - attempt} retries left!"
             )
-            return None
+            time.sleep(delay)
 
     def get_cache_file_name(self, file_name):
-        file_name = file_name.encode("utf-8")
-        file_name = base64.b64encode(file_name)
-        if type(file_name) is bytes:
-            file_name = file_name.decode("utf-8")
-        # Ruh roh, / is a vaild Base64 character
-        # but also a valid UNIX path separator!
-        file_name = file_name.replace("/", "-")
-        file_name = f"{file_name}.jpg"
-
-        return os.path.join(self._cache_dir, file_name)
+        return self._cache.get_path(file_name)
 
     def get_default_album_art(self):
         """Return binary version of default album art."""
@@ -0,0 +1,532 @@
+"""
+Album art cache management.
+"""
+import base64
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+# Leading and trailing bytes of complete JPEG and PNG files
+JPEG_START = b"\xff\xd8\xff"
+JPEG_END = b"\xff\xd9"
+PNG_START = b"\x89PNG\r\n\x1a\n"
+PNG_END = b"IEND\xae\x42\x60\x82"
+
+# How far from the end of a file to look for the end marker, some encoders
+# pad their output
+TRAILER_BYTES = 64
+
+
+def write_file(path, data):
+    """Write data to path atomically.
+
+    The data is written to a temporary file alongside path, synced to disk
+    and renamed over it, so that readers, including other processes, never
+    see a partially written file, even after a crash or power cut.
+
+    """
+    temp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_file, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_file)
+        raise
+
+    _sync_dir(os.path.dirname(path))
+
+
+def _sync_dir(path):
+    """Make sure a rename into the directory at path survives a crash."""
+    try:
+        fd = os.open(path or ".", os.O_RDONLY)
+    except OSError:  # Directories can't be opened on Windows
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def is_complete(path, size=None):
+    """Return True if the image at path doesn't look truncated or corrupt.
+
+    Checks the file is the expected size, if given, and that JPEG and PNG
+    images start and end with the right markers. Other formats are only
+    checked for size.
+
+    """
+    try:
+        with open(path, "rb") as f:
+            head = f.read(len(PNG_START))
+            f.seek(0, os.SEEK_END)
+            length = f.tell()
+            f.seek(max(0, length - TRAILER_BYTES))
+            tail = f.read()
+    except OSError:
+        return False
+
+    if length == 0 or (size is not None and length != size):
+        return False
+    if head.startswith(JPEG_START):
+        return JPEG_END in tail
+    if head.startswith(PNG_START):
+        return PNG_END in tail
+    return True
+
+
+class ArtCache:
+    """Size bounded, least recently used cache of album art files.
+
+    An index of every cached file, its source key, size and last access time
+    is kept alongside the art so that lookups never need to touch the
+    filesystem and startup doesn't need to stat the whole cache directory.
+    The index also records misses, keys known to have no art, until they
+    expire.
+
+    The index is saved in batches, by flush and close, rather than every
+    time it changes.
+
+    Art is written atomically and checked for truncation when it is read.
+    If Mopidy didn't shut down cleanly last time, every file is checked at
+    startup, art stored since the index was saved is indexed again, and
+    corrupt files are moved to a quarantine directory.
+
+    If shared_dir is given, art is stored once in that directory, named by
+    the hash of its content, and shared by every cache that uses it. Each
+    cache keeps its own index and limits, and links the art it uses into
+    its own directory. Shared art is deleted once no cache links to it.
+
+    """
+
+    index_name = "index.json"
+
+    # Changes to hold in memory before the index is saved, between the
+    # periodic flushes
+    max_unsaved_changes = 100
+    quarantine_name = "quarantine"
+
+    def __init__(self, cache_dir, max_bytes=0, max_entries=0, shared_dir=None):
+        """Initialise the cache, a limit of 0 means unlimited."""
+        self._cache_dir = cache_dir
+        self._shared_dir = shared_dir
+        self._max_bytes = max_bytes
+        self._max_entries = max_entries
+        self._index_file = os.path.join(self._cache_dir, self.index_name)
+        self._lock = threading.RLock()
+        # File name -> entry, ordered from least to most recently used
+        self._entries = OrderedDict()
+        # Key -> when the miss expires, and what to look up to retry it
+        self._misses = {}
+        self._total_bytes = 0
+        self._index_dirty = False
+        self._unsaved_changes = 0
+
+        if self._shared_dir is not None:
+            for name in ("blobs", "keys", "locks"):
+                os.makedirs(os.path.join(self._shared_dir, name), exist_ok=True)
+
+        self._load_index()
+
+    def __contains__(self, key):
+        return self.get_file_name(key) in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def get_file_name(self, key):
+        """Return the cache file name used to store art for key."""
+        file_name = base64.b64encode(key.encode("utf-8")).decode("utf-8")
+
+        # Ruh roh, / is a vaild Base64 character
+        # but also a valid UNIX path separator!
+        file_name = file_name.replace("/", "-")
+        return f"{file_name}.jpg"
+
+    def get_path(self, key):
+        return os.path.join(self._cache_dir, self.get_file_name(key))
+
+    def get(self, key):
+        """Return the path to the cached art for key, or None on a miss."""
+        file_name = self.get_file_name(key)
+
+        with self._lock:
+            entry = self._entries.get(file_name)
+            if entry is None:
+                return self._get_shared(key)
+
+            path = os.path.join(self._cache_dir, file_name)
+            if not is_complete(path, entry["size"]):
+                self._quarantine(file_name)
+                self._index_changed()
+                return None
+
+            entry["atime"] = time.time()
+            self._entries.move_to_end(file_name)
+            self._index_dirty = True
+
+        return path
+
+    def put(self, key, data):
+        """Store data as the art for key and return its path."""
+        file_name = self.get_file_name(key)
+        path = os.path.join(self._cache_dir, file_name)
+
+        if self._shared_dir is None:
+            write_file(path, data)
+        else:
+            blob = self._get_blob_path(hashlib.sha256(data).hexdigest())
+            if not os.path.exists(blob):
+                write_file(blob, data)
+            self._link_shared(file_name, blob)
+            if not self._link_blob(blob, path):
+                write_file(path, data)
+
+        with self._lock:
+            self._add_entry(key, file_name, len(data))
+            self._index_changed()
+
+        return path
+
+    @contextlib.contextmanager
+    def lock(self, key):
+        """Hold a lock on key across every process sharing the cache.
+
+        Used to make sure that only one of the processes sharing a cache
+        fetches art for key, the others wait and then find it in the cache.
+        Does nothing when the cache isn't shared.
+
+        """
+        if self._shared_dir is None or fcntl is None:
+            yield
+            return
+
+        lock_file = os.path.join(
+            self._shared_dir, "locks", f"{self.get_file_name(key)}.lock"
+        )
+        with open(lock_file, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def discard(self, key):
+        """Remove the art for key from the cache, if present."""
+        file_name = self.get_file_name(key)
+
+        with self._lock:
+            if self._remove_entry(file_name):
+                self._delete_file(file_name)
+                self._index_changed()
+
+    def add_miss(self, key, ttl, source=None):
+        """Remember that there is no art for key, for ttl seconds.
+
+        source is whatever is needed to look the art up again once the miss
+        has expired, and must be JSON serialisable.
+
+        """
+        with self._lock:
+            self._misses[key] = {"expires": time.time() + ttl, "source": source}
+            self._index_changed()
+
+    def is_miss(self, key):
+        """Return True if key is known to have no art."""
+        with self._lock:
+            miss = self._misses.get(key)
+            if miss is None:
+                return False
+            if miss["expires"] <= time.time():
+                del self._misses[key]
+                self._index_dirty = True
+                return False
+            return True
+
+    def get_expired_misses(self):
+        """Return (key, source) for each miss that has expired."""
+        now = time.time()
+        with self._lock:
+            return [
+                (key, miss["source"])
+                for key, miss in self._misses.items()
+                if miss["expires"] <= now
+            ]
+
+    def flush(self):
+        """Save the index if it has changed since it was last saved."""
+        with self._lock:
+            if self._index_dirty:
+                self._save_index()
+
+    def close(self):
+        """Save the index, recording that the cache was shut down cleanly."""
+        with self._lock:
+            self._save_index(clean=True)
+
+    def _get_shared(self, key):
+        """Link art stored in the shared cache by another process for key."""
+        if self._shared_dir is None:
+            return None
+
+        file_name = self.get_file_name(key)
+        path = os.path.join(self._cache_dir, file_name)
+        blob = self._get_shared_blob(file_name)
+        if blob is None or not is_complete(blob):
+            return None
+        if not self._link_blob(blob, path):
+            return None
+
+        self._add_entry(key, file_name, os.path.getsize(path))
+        self._index_changed()
+        return path
+
+    def _get_blob_path(self, digest):
+        return os.path.join(self._shared_dir, "blobs", f"{digest}.jpg")
+
+    def _get_shared_blob(self, file_name):
+        try:
+            digest = os.readlink(os.path.join(self._shared_dir, "keys", file_name))
+        except OSError:
+            return None
+        return self._get_blob_path(os.path.basename(digest)[: -len(".jpg")])
+
+    def _link_shared(self, file_name, blob):
+        """Point the shared key for file_name at blob."""
+        link = os.path.join(self._shared_dir, "keys", file_name)
+        temp_link = f"{link}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.symlink(os.path.join("..", "blobs", os.path.basename(blob)), temp_link)
+        os.replace(temp_link, link)
+
+    def _link_blob(self, blob, path):
+        """Hard link blob to path, returning False if that isn't possible."""
+        temp_link = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.link(blob, temp_link)
+            os.replace(temp_link, path)
+        except OSError as err:
+            # Missing, deleted by another process, or on another filesystem
+            logger.debug(f"mopidy-pidi: unable to link shared album art: {err}")
+            with contextlib.suppress(OSError):
+                os.remove(temp_link)
+            return False
+        return True
+
+    def _index_changed(self):
+        """Record a change to the index, saving it once enough build up.
+
+        Saving rewrites the whole index, so doing it for every change would
+        wear out an SD card. Art stored since the last save is found again
+        on disk if Mopidy doesn't shut down cleanly.
+
+        """
+        self._index_dirty = True
+        self._unsaved_changes += 1
+        if self._unsaved_changes >= self.max_unsaved_changes:
+            self._save_index()
+
+    def _add_entry(self, key, file_name, size):
+        self._remove_entry(file_name)
+        self._entries[file_name] = {
+            "key": key,
+            "size": size,
+            "atime": time.time(),
+        }
+        self._total_bytes += size
+        self._misses.pop(key, None)
+        self._evict(keep=file_name)
+
+    def _over_limit(self):
+        if self._max_entries > 0 and len(self._entries) > self._max_entries:
+            return True
+        if self._max_bytes > 0 and self._total_bytes > self._max_bytes:
+            return True
+        return False
+
+    def _evict(self, keep=None):
+        while self._over_limit():
+            file_name = next(iter(self._entries))
+            if file_name == keep:
+                # Never evict the entry we've just been asked to store
+                break
+            self._remove_entry(file_name)
+            self._delete_file(file_name)
+            logger.debug(f"mopidy-pidi: evicted {file_name} from album art cache")
+
+    def _remove_entry(self, file_name):
+        entry = self._entries.pop(file_name, None)
+        if entry is None:
+            return False
+        self._total_bytes -= entry["size"]
+        return True
+
+    def _quarantine(self, file_name):
+        """Move a corrupt file out of the way, where it can be inspected."""
+        logger.warning(f"mopidy-pidi: quarantining corrupt album art {file_name}")
+        self._remove_entry(file_name)
+
+        quarantine_dir = os.path.join(self._cache_dir, self.quarantine_name)
+        os.makedirs(quarantine_dir, exist_ok=True)
+        try:
+            os.replace(
+                os.path.join(self._cache_dir, file_name),
+                os.path.join(quarantine_dir, file_name),
+            )
+        except FileNotFoundError:
+            pass
+
+        if self._shared_dir is not None:
+            # The shared copy is the same file, so no one else should use it
+            paths = [os.path.join(self._shared_dir, "keys", file_name)]
+            blob = self._get_shared_blob(file_name)
+            if blob is not None:
+                paths.append(blob)
+            for path in paths:
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+
+    def _quarantine_corrupt_files(self):
+        corrupt = []
+        for file_name, entry in list(self._entries.items()):
+            path = os.path.join(self._cache_dir, file_name)
+            if not os.path.exists(path):
+                # Deleted since the index was last saved
+                self._remove_entry(file_name)
+            elif not is_complete(path, entry["size"]):
+                corrupt.append(file_name)
+        for file_name in corrupt:
+            self._quarantine(file_name)
+        return corrupt
+
+    def _delete_file(self, file_name):
+        try:
+            os.remove(os.path.join(self._cache_dir, file_name))
+        except FileNotFoundError:
+            pass
+
+        if self._shared_dir is not None:
+            self._delete_unused_blob(file_name)
+
+    def _delete_unused_blob(self, file_name):
+        blob = self._get_shared_blob(file_name)
+        if blob is None:
+            return
+
+        # Racing another process linking the blob at worst costs it a fetch,
+        # since a blob that has already been linked outlives its name.
+        try:
+            if os.stat(blob).st_nlink > 1:
+                # Still linked into another cache
+                return
+            os.remove(blob)
+            os.remove(os.path.join(self._shared_dir, "keys", file_name))
+        except FileNotFoundError:
+            pass
+
+    def _load_index(self):
+        try:
+            with open(self._index_file) as f:
+                index = json.load(f)
+            entries = index["entries"]
+            self._misses = index["misses"]
+            clean = index.get("clean", False)
+        except FileNotFoundError:
+            self._rebuild_index()
+            return
+        except (KeyError, TypeError, ValueError):
+            logger.warning("mopidy-pidi: album art cache index is corrupt, rebuilding")
+            self._rebuild_index()
+            return
+
+        for entry in sorted(entries, key=lambda entry: entry["atime"]):
+            self._entries[entry.pop("file")] = entry
+            self._total_bytes += entry["size"]
+
+        if not clean:
+            # Pick up art stored since the index was last saved, and check
+            # for art that was being written when Mopidy stopped
+            self._index_files()
+            self._quarantine_corrupt_files()
+
+        # Until close saves it again, the index on disk won't reflect what
+        # happens to the cache, so mustn't be trusted after a power cut
+        self._save_index()
+        self._evict()
+
+    def _rebuild_index(self):
+        """Index art left behind by a version that didn't keep an index."""
+        self._index_files()
+
+        # Art left behind by a version that didn't write files atomically
+        self._quarantine_corrupt_files()
+        self._evict()
+        self._save_index()
+
+    def _index_files(self):
+        """Add art in the cache directory that is missing from the index.
+
+        Temporary files left by writes that never finished are deleted.
+
+        """
+        files = []
+        with os.scandir(self._cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(".tmp") and entry.is_file():
+                    with contextlib.suppress(OSError):
+                        os.remove(entry.path)
+                elif self._is_art_file(entry) and entry.name not in self._entries:
+                    files.append(entry)
+
+        for entry in sorted(files, key=lambda entry: entry.stat().st_atime):
+            stat = entry.stat()
+            self._entries[entry.name] = {
+                "key": self._get_key(entry.name),
+                "size": stat.st_size,
+                "atime": stat.st_atime,
+            }
+            self._total_bytes += stat.st_size
+
+    def _is_art_file(self, entry):
+        # Skip the index and the default art, which is never evicted
+        if not entry.is_file() or entry.name.startswith("__"):
+            return False
+        return entry.name.endswith(".jpg")
+
+    def _get_key(self, file_name):
+        try:
+            file_name = file_name[: -len(".jpg")].replace("-", "/")
+            return base64.b64decode(file_name).decode("utf-8")
+        except ValueError:
+            return None
+
+    def _save_index(self, clean=False):
+        entries = [
+            dict(entry, file=file_name) for file_name, entry in self._entries.items()
+        ]
+        index = {"entries": entries, "misses": self._misses, "clean": clean}
+        write_file(self._index_file, json.dumps(index).encode("utf-8"))
+        self._index_dirty = False
+        self._unsaved_changes = 0
@@ -0,0 +1,189 @@
+"""
+Command line tools, run as mopidy pidi <command>.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pykka
+from mopidy import commands, core
+from mopidy.models import Ref
+
+from .frontend import PiDiConfig, PiDiFrontend, create_brainz
+from .library import LibraryImages
+from .local import LocalArt
+
+logger = logging.getLogger(__name__)
+
+
+class PiDiCommand(commands.Command):
+    help = "Manage the PiDi album art cache."
+
+    def __init__(self):
+        super().__init__()
+        self.add_child("warm-cache", WarmCacheCommand())
+
+
+class WarmCacheCommand(commands.Command):
+    help = "Fetch album art for every album in the library."
+
+    # URIs passed to each library lookup or get_images call
+    batch_size = 50
+
+    # Seconds between progress reports
+    progress_interval = 5
+
+    def __init__(self):
+        super().__init__()
+        self.add_argument(
+            "--uri",
+            action="append",
+            dest="uris",
+            metavar="URI",
+            help="only fetch art for albums below this library URI, "
+            "may be given more than once (default: the whole library)",
+        )
+        self.add_argument(
+            "--concurrency",
+            type=int,
+            default=4,
+            help="number of albums to fetch art for at once (default: 4)",
+        )
+
+    def run(self, args, config):
+        backends = []
+        for backend_class in args.registry["backend"]:
+            try:
+                backend = backend_class.start(config=config, audio=None).proxy()
+            except Exception:
+                logger.exception(f"mopidy-pidi: unable to start {backend_class}")
+                continue
+            backends.append(backend)
+
+        # Album art lookups are still rate limited by Brainz, this limits
+        # how many albums are waiting on a lookup or download at once.
+        display_config = PiDiConfig(config["pidi"])
+        brainz = create_brainz(config, display_config, max_workers=args.concurrency)
+        try:
+            mopidy_core = core.Core.start(
+                config=config, mixer=None, backends=backends, audio=None
+            ).proxy()
+            self.warm_cache(
+                mopidy_core.library,
+                brainz,
+                display_config,
+                uris=args.uris,
+                concurrency=args.concurrency,
+                local_art=LocalArt(media_dir=config.get("local", {}).get("media_dir")),
+            )
+        finally:
+            brainz.shutdown()
+            pykka.ActorRegistry.stop_all()
+
+        return 0
+
+    def warm_cache(
+        self,
+        library,
+        brainz,
+        display_config,
+        uris=None,
+        concurrency=4,
+        local_art=None,
+    ):
+        """Fetch and cache art for every album below uris in library.
+
+        Returns the number of albums with art, and the number of albums.
+
+        """
+        library_images = LibraryImages(library)
+
+        start = time.monotonic()
+        albums = self._find_albums(library, uris or [None])
+        logger.info(f"mopidy-pidi: found {len(albums)} albums in the library")
+
+        futures = []
+        with ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="pidi-warm"
+        ) as executor:
+            album_items = list(albums.items())
+            for i in range(0, len(album_items), self.batch_size):
+                batch = album_items[i : i + self.batch_size]
+                images = library_images.get_images([uri for _, uri in batch]).get()
+                for (artist, album), uri in batch:
+                    art = None
+                    if local_art is not None:
+                        art = local_art.find_art(uri)
+                    if art is None:
+                        art = PiDiFrontend.select_art_uri(images[uri], display_config)
+                    futures.append(
+                        executor.submit(self._fetch_art, brainz, art, artist, album)
+                    )
+
+            found = 0
+            last_report = time.monotonic()
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    file_name = future.result()
+                except Exception as err:
+                    logger.info(f"mopidy-pidi: unable to fetch album art: {err}")
+                    continue
+                if file_name is not None and not brainz.is_default_art(file_name):
+                    found += 1
+
+                now = time.monotonic()
+                if now - last_report >= self.progress_interval:
+                    last_report = now
+                    logger.info(
+                        f"mopidy-pidi: fetched art for {done} of {len(futures)} "
+                        f"albums, {done / (now - start):.1f} albums/s"
+                    )
+
+        elapsed = time.monotonic() - start
+        logger.info(
+            f"mopidy-pidi: warmed the album art cache in {elapsed:.1f}s, "
+            f"{found} of {len(futures)} albums have art"
+        )
+        return found, len(futures)
+
+    def _find_albums(self, library, uris):
+        """Return {(artist, album): uri of one of its tracks} below uris."""
+        albums = {}
+        uris = list(self._browse(library, uris))
+        for i in range(0, len(uris), self.batch_size):
+            results = library.lookup(uris=uris[i : i + self.batch_size]).get()
+            for tracks in results.values():
+                for track in tracks:
+                    title, album, artist = PiDiFrontend.get_track_info(track)
+                    # Matches the lookup made when the track is played
+                    albums.setdefault((artist, album or title), track.uri)
+        return albums
+
+    def _browse(self, library, uris):
+        """Yield the URI of every album and track below uris."""
+        pending = list(uris)
+        seen = set()
+        while pending:
+            for ref in library.browse(pending.pop()).get():
+                if ref.uri in seen:
+                    continue
+                seen.add(ref.uri)
+                if ref.type in (Ref.ALBUM, Ref.TRACK):
+                    yield ref.uri
+                elif ref.type in (Ref.ARTIST, Ref.DIRECTORY):
+                    pending.append(ref.uri)
+
+    def _fetch_art(self, brainz, art, artist, album):
+        if art is not None:
+            if os.path.isfile(art):
+                file_name = brainz.get_file_art(art)
+            elif art.startswith("http://") or art.startswith("https://"):
+                file_name = brainz.get_url_art(art)
+            else:
+                file_name = None
+
+            if file_name is not None:
+                return file_name
+
+        return brainz.get_album_art(artist, album)
@@ -0,0 +1,98 @@
+"""
+Coalescing of bursty events.
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Coalescer:
+    """Collapse bursts of calls for the same key into the latest one.
+
+    call() runs a function straight away, then for window seconds keeps
+    only the latest call for the same key, which is made when the window
+    closes. debounce() waits until there have been no calls for the key for
+    delay seconds, and then makes the latest.
+
+    Deferred calls are passed to run(fn, args) from a timer thread, so that
+    an actor can hand them back to its own thread.
+
+    """
+
+    def __init__(self, run, window=0.1):
+        self._run = run
+        self._window = window
+        self._lock = threading.Lock()
+        # Key -> timer closing its window, or ending its debounce delay
+        self._timers = {}
+        # Key -> (fn, args, reopen) of the latest deferred call
+        self._pending = {}
+
+    def call(self, key, fn, *args):
+        """Call fn(*args) now, or as the latest call once the window closes."""
+        with self._lock:
+            if key in self._timers:
+                self._pending[key] = (fn, args, True)
+                return
+            self._start_timer(key, self._window)
+
+        fn(*args)
+
+    def debounce(self, key, delay, fn, *args):
+        """Call fn(*args) once there have been no calls for key for delay."""
+        with self._lock:
+            timer = self._timers.pop(key, None)
+            if timer is not None:
+                timer.cancel()
+            self._pending[key] = (fn, args, False)
+            self._start_timer(key, delay)
+
+    def flush(self, key):
+        """Make any deferred call for key now, from the calling thread."""
+        with self._lock:
+            pending = self._cancel(key)
+
+        if pending is not None:
+            fn, args, _ = pending
+            fn(*args)
+
+    def cancel(self, key):
+        """Drop any deferred call for key."""
+        with self._lock:
+            self._cancel(key)
+
+    def cancel_all(self):
+        with self._lock:
+            for key in list(self._timers):
+                self._cancel(key)
+
+    def _cancel(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        return self._pending.pop(key, None)
+
+    def _start_timer(self, key, delay):
+        timer = threading.Timer(delay, self._expire, args=(key,))
+        timer.daemon = True
+        self._timers[key] = timer
+        timer.start()
+
+    def _expire(self, key):
+        with self._lock:
+            if self._timers.get(key) is not threading.current_thread():
+                # Cancelled, or replaced by a later debounce
+                return
+            del self._timers[key]
+            pending = self._pending.pop(key, None)
+            if pending is not None and pending[2]:
+                # Keep coalescing while the burst goes on
+                self._start_timer(key, self._window)
+
+        if pending is not None:
+            fn, args, _ = pending
+            try:
+                self._run(fn, args)
+            except Exception:
+                logger.exception("mopidy-pidi: error handling coalesced event")
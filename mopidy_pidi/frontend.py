@@ -1,19 +1,61 @@
+import collections
 import logging
 import os
 import threading
 import time
 
 import pykka
-import requests
 from mopidy import core
 
 import netifaces
 
-from . import Extension
+from . import Extension, image, metrics
 from .brainz import Brainz
+from .cache import ArtCache
+from .events import Coalescer
+from .library import LibraryImages
+from .local import LocalArt
+from .plugin import (
+    ALL_REGIONS,
+    REGION_ART,
+    REGION_PROGRESS,
+    REGION_STATE,
+    REGION_TEXT,
+)
 
 logger = logging.getLogger(__name__)
 
+frames = metrics.registry.counter("pidi_frames_total", "Frames drawn to the display")
+frames_skipped = metrics.registry.counter(
+    "pidi_frames_skipped_total", "Render loop wake-ups with nothing to redraw"
+)
+redraw_seconds = metrics.registry.histogram(
+    "pidi_redraw_seconds", "Time taken to draw each frame to the display"
+)
+art_update_seconds = metrics.registry.histogram(
+    "pidi_art_update_seconds",
+    "Time from a track's album art being requested to it being displayed",
+)
+
+
+def create_brainz(config, display_config, **kwargs):
+    """Return a Brainz caching art prepared for the configured display."""
+    cache_dir = Extension.get_data_dir(config)
+    cache = ArtCache(
+        cache_dir,
+        max_bytes=config["pidi"].get("cache_max_mb", 0) * 1024 * 1024,
+        max_entries=config["pidi"].get("cache_max_entries", 0),
+        shared_dir=config["pidi"].get("shared_cache_dir"),
+    )
+    return Brainz(
+        cache_dir=cache_dir,
+        cache=cache,
+        art_size=display_config.size,
+        art_blur=display_config.blur_album_art,
+        miss_ttl=config["pidi"].get("cache_miss_ttl"),
+        **kwargs,
+    )
+
 
 class PiDiConfig:
     def __init__(self, config=None):
@@ -27,12 +69,26 @@ class PiDiConfig:
         self.blur_album_art = True
 
 
+# A call deferred by the frontend's Coalescer, to be made in the actor
+DeferredCall = collections.namedtuple("DeferredCall", ["fn", "args"])
+
+
 class PiDiFrontend(pykka.ThreadingActor, core.CoreListener):
+    # Seconds over which bursts of volume and seek events are coalesced
+    event_window = 0.1
+
+    # Seconds to wait for skipping through tracks to settle before showing,
+    # and fetching art for, the track that was settled on
+    track_settle_delay = 0.3
+
     def __init__(self, config, core):
         super().__init__()
         self.core = core
         self.config = config
         self.current_track = None
+        self.library_images = LibraryImages(self.core.library)
+        self.local_art = LocalArt(media_dir=config.get("local", {}).get("media_dir"))
+        self.events = Coalescer(self._defer, window=self.event_window)
 
     def on_start(self):
         self.display = PiDi(self.config)
@@ -61,9 +117,22 @@ class PiDiFrontend(pykka.ThreadingActor, core.CoreListener):
                     self.display.update_album_art(art="")
 
     def on_stop(self):
+        self.events.cancel_all()
         self.display.stop()
         self.display = None
 
+    def on_receive(self, message):
+        if isinstance(message, DeferredCall):
+            return message.fn(*message.args)
+        return super().on_receive(message)
+
+    def _defer(self, fn, args):
+        """Make a call deferred by the Coalescer in this actor's thread."""
+        try:
+            self.actor_ref.tell(DeferredCall(fn, args))
+        except pykka.ActorDeadError:
+            pass
+
     def get_ifaddress(self, iface, family):
         try:
             return netifaces.ifaddresses(iface)[family][0]["addr"]
@@ -78,6 +147,8 @@ class PiDiFrontend(pykka.ThreadingActor, core.CoreListener):
             shuffle=self.core.tracklist.get_random(),
             repeat=self.core.tracklist.get_repeat(),
         )
+        # Shuffle and repeat change which tracks come next
+        self.events.debounce("prefetch", self.track_settle_delay, self.prefetch_art)
 
     def playlist_changed(self, playlist):
         pass
@@ -89,26 +160,58 @@ class PiDiFrontend(pykka.ThreadingActor, core.CoreListener):
         pass
 
     def seeked(self, time_position):
-        self.update_elapsed(time_position)
+        # A pending track start would reset the position to 0
+        self.events.flush("track")
+        self.events.call("elapsed", self.update_elapsed, time_position)
 
     def stream_title_changed(self, title):
+        # A pending track start would replace the title with the track's
+        self.events.flush("track")
         self.display.update(title=title)
 
     def track_playback_ended(self, tl_track, time_position):
-        self.update_elapsed(time_position)
-        self.display.update(state="pause")
+        # Mopidy ends each track just before starting the next. Replacing a
+        # pending start drops the track being skipped, and the next start
+        # replaces the end, so only the end of playback is shown.
+        self.events.cancel("elapsed")
+        self.events.debounce(
+            "track", self.track_settle_delay, self.end_track, time_position
+        )
 
     def track_playback_paused(self, tl_track, time_position):
+        self.settle_events()
         self.update_elapsed(time_position)
         self.display.update(state="pause")
 
     def track_playback_resumed(self, tl_track, time_position):
+        self.settle_events()
         self.update_elapsed(time_position)
         self.display.update(state="play")
 
     def track_playback_started(self, tl_track):
+        # Skipping through tracks starts each in turn, only the last needs
+        # showing and its art fetching
+        self.events.debounce(
+            "track", self.track_settle_delay, self.start_track, tl_track
+        )
+
+    def start_track(self, tl_track):
         self.update_track(tl_track.track, 0)
         self.display.update(state="play")
+        self.prefetch_art(tl_track)
+
+    def end_track(self, time_position):
+        self.update_elapsed(time_position)
+        self.display.update(state="pause")
+
+    def settle_events(self):
+        """Apply a pending track start, ahead of an event that follows it.
+
+        A pending seek is dropped, since the event has a newer position.
+
+        """
+        self.events.flush("track")
+        self.events.cancel("elapsed")
 
     def update_elapsed(self, time_position):
         self.display.update(elapsed=float(time_position))
@@ -117,6 +220,30 @@ class PiDiFrontend(pykka.ThreadingActor, core.CoreListener):
         if track is None:
             track = self.core.playback.get_current_track().get()
 
+        title, album, artist = self.get_track_info(track)
+
+        self.display.update(title=title, album=album, artist=artist)
+
+        if time_position is not None:
+            length = track.length
+            # Default to 60s long and loop the transport bar
+            if length is None:
+                length = 60
+                time_position %= length
+
+            self.display.update(elapsed=float(time_position), length=float(length))
+
+        # Resolved by the display's art workers, so a slow backend or disk
+        # doesn't hold up this actor
+        art = self.library_images.get_images([track.uri]).map(
+            lambda images: self.get_local_art(track.uri)
+            or self.get_art_uri(images[track.uri])
+        )
+
+        self.display.update_album_art(art=art)
+
+    @staticmethod
+    def get_track_info(track):
         title = ""
         album = ""
         artist = ""
@@ -130,161 +257,574 @@ class PiDiFrontend(pykka.ThreadingActor, core.CoreListener):
         if track.artists is not None:
             artist = ", ".join([artist.name for artist in track.artists])
 
-        self.display.update(title=title, album=album, artist=artist)
+        return title, album, artist
 
-        if time_position is not None:
-            length = track.length
-            # Default to 60s long and loop the transport bar
-            if length is None:
-                length = 60
-                time_position %= length
+    def get_local_art(self, uri):
+        """Return art for a file: or local: track found on disk, or None.
 
-            self.display.update(elapsed=float(time_position), length=float(length))
+        Local art is preferred over the library's images, so that local
+        files never need to wait on a download or a MusicBrainz search.
 
-        art = None
-        track_images = self.core.library.get_images([track.uri]).get()
-        if track.uri in track_images:
-            track_images = track_images[track.uri]
-            if len(track_images) == 1:
-                art = track_images[0].uri
-            else:
-                for image in track_images:
-                    if image.width is None or image.height is None:
-                        continue
-                    if image.height >= 240 and image.width >= 240:
-                        art = image.uri
+        """
+        try:
+            return self.local_art.find_art(uri)
+        except Exception as err:
+            logger.info(f"mopidy-pidi: unable to find local album art: {err}")
+            return None
 
-        self.display.update_album_art(art=art)
+    def get_art_uri(self, track_images):
+        return self.select_art_uri(track_images, self.display.display_config)
+
+    @staticmethod
+    def select_art_uri(track_images, display_config):
+        """Pick the smallest image that covers the display.
+
+        Falls back to the largest image if none are big enough, and to the
+        first image if none of them know their size.
+
+        """
+        if not track_images:
+            return None
+
+        width = height = display_config.size
+        if display_config.rotation in (90, 270):
+            width, height = height, width
+
+        candidates = sorted(
+            (
+                track_image
+                for track_image in track_images
+                if track_image.width is not None and track_image.height is not None
+            ),
+            key=lambda track_image: track_image.width * track_image.height,
+        )
+
+        for track_image in candidates:
+            if track_image.width >= width and track_image.height >= height:
+                return track_image.uri
+
+        if candidates:
+            return candidates[-1].uri
+
+        return track_images[0].uri
+
+    def prefetch_art(self, tl_track=None):
+        """Warm the art cache for the tracks that will play next."""
+        count = self.config["pidi"].get("prefetch", 3)
+        if count == 0:
+            return
+
+        tracks = self.get_upcoming_tracks(tl_track, count)
+        if not tracks:
+            return
+
+        images = self.library_images.get_images([track.uri for track in tracks])
+
+        for track in tracks:
+            title, album, artist = self.get_track_info(track)
+            art = images.map(
+                lambda images, uri=track.uri: self.get_local_art(uri)
+                or self.get_art_uri(images[uri])
+            )
+            self.display.prefetch_album_art(artist, album or title, art)
+
+    def get_upcoming_tracks(self, tl_track, count):
+        """Return up to count tracks that play after tl_track, in order.
+
+        Without tl_track, the tracks from the next one to play onwards.
+
+        """
+        tracklist = self.core.tracklist
+        # Asked for together, so the core answers in a single round trip
+        tl_tracks, random, repeat, next_tlid = pykka.get_all(
+            [
+                tracklist.get_tl_tracks(),
+                tracklist.get_random(),
+                tracklist.get_repeat(),
+                tracklist.get_next_tlid(),
+            ]
+        )
+        tlids = [t.tlid for t in tl_tracks]
+
+        if random:
+            # Only the core knows the shuffled order beyond the next track
+            if next_tlid not in tlids:
+                return []
+            return [tl_tracks[tlids.index(next_tlid)].track]
+
+        if tl_track is not None and tl_track.tlid in tlids:
+            start = tlids.index(tl_track.tlid) + 1
+        elif next_tlid in tlids:
+            start = tlids.index(next_tlid)
+        else:
+            return []
+
+        upcoming = tl_tracks[start:]
+        if repeat:
+            upcoming += tl_tracks[:start]
+        return [t.track for t in upcoming[:count]]
 
     def tracklist_changed(self):
-        pass
+        self.events.debounce("prefetch", self.track_settle_delay, self.prefetch_art)
 
     def volume_changed(self, volume):
         if volume is None:
             return
 
+        self.events.call("volume", self.update_volume, volume)
+
+    def update_volume(self, volume):
         self.display.update(volume=volume)
 
 
+# Map each attribute accepted by PiDi.update to the region it dirties
+UPDATE_REGIONS = {
+    "shuffle": REGION_STATE,
+    "repeat": REGION_STATE,
+    "state": REGION_STATE,
+    "volume": REGION_STATE,
+    "elapsed": REGION_PROGRESS,
+    "length": REGION_PROGRESS,
+    "title": REGION_TEXT,
+    "album": REGION_TEXT,
+    "artist": REGION_TEXT,
+}
+
+
+class DisplayState(
+    collections.namedtuple(
+        "DisplayState",
+        [
+            "version",
+            "shuffle",
+            "repeat",
+            "state",
+            "volume",
+            "elapsed",
+            "length",
+            "title",
+            "album",
+            "artist",
+            "elapsed_at",
+        ],
+        defaults=[0, False, False, "stop", 100, 0, 0, "", "", "", 0],
+    )
+):
+    """Immutable snapshot of everything the display shows.
+
+    PiDi.update swaps in a new snapshot rather than modifying the current
+    one, so the render thread always sees a consistent set of values
+    without taking a lock. version increases with every change.
+
+    elapsed is the track position in milliseconds as of elapsed_at, a
+    time.time() timestamp.
+
+    """
+
+    __slots__ = ()
+
+    def get_elapsed(self, now):
+        """Return the track position at time now."""
+        if self.state != "play":
+            return self.elapsed
+        return self.elapsed + (now - self.elapsed_at) * 1000
+
+    def get_progress(self, now):
+        """Return the fraction of the track played at time now."""
+        if not self.length:
+            return 0
+        return min(1.0, float(self.get_elapsed(now)) / float(self.length))
+
+
 class PiDi:
+    # Number of decoded covers to keep in memory
+    art_image_cache_covers = 8
+
+    # Seconds to wait for a backend to list a track's images
+    art_resolve_timeout = 10
+
     def __init__(self, config):
         self.config = config
         self.cache_dir = Extension.get_data_dir(config)
         self.display_config = PiDiConfig(config["pidi"])
-        self.display_class = Extension.get_display_types()[
-            self.config["pidi"]["display"]
-        ]
+        self.display_class = Extension.get_display_class(self.config["pidi"]["display"])
         self.idle_timeout = config["pidi"].get("idle_timeout", 0)
+        self.min_fps = config["pidi"].get("min_fps", 0.2)
+        self.max_fps = config["pidi"].get("max_fps", 30)
 
-        self._brainz = Brainz(cache_dir=self.cache_dir)
+        self._brainz = create_brainz(config, self.display_config)
+        if image.available():
+            # Brainz blurs art as it is cached, so the display needn't
+            self.display_config.blur_album_art = False
         self._display = self.display_class(self.display_config)
         self._running = threading.Event()
-        self._delay = 1.0 / 30
+        self._min_delay = 1.0 / self.max_fps
+        self._max_delay = 1.0 / self.min_fps
         self._thread = None
 
-        self.shuffle = False
-        self.repeat = False
-        self.state = "stop"
-        self.volume = 100
-        self.progress = 0
-        self.elapsed = 0
-        self.length = 0
-        self.title = ""
-        self.album = ""
-        self.artist = ""
-        self._last_progress_update = time.time()
-        self._last_progress_value = 0
+        # Replaced, never modified, by update. Writers hold _state_lock.
+        self._state = DisplayState(elapsed_at=time.time())
+        self._state_lock = threading.Lock()
+        self._rendered_version = None
         self._last_state_change = 0
         self._last_art = ""
+        self._art_lock = threading.Lock()
+        self._art_generation = 0
+        self._art_future = None
+        self._art_requested_at = None
+        self._art_images = None
+        if image.available() and self._display.supports_album_art_image:
+            # Sized once the display plugin has settled the art size
+            size = self.display_config.size
+            self._art_images = image.ImageCache(
+                self.art_image_cache_covers * size * size * 3
+            )
+
+        self._wake = threading.Condition()
+        self._dirty = set(ALL_REGIONS)
+        # Set while the panel is blanked and the loop is asleep
+        self._blanked = False
+        self._last_progress_pixel = None
+        self._last_frame = 0
+
+        self._metrics_reporter = None
+        metrics_interval = config["pidi"].get("metrics_interval", 0)
+        if metrics_interval > 0:
+            self._metrics_reporter = metrics.Reporter(
+                metrics.registry,
+                metrics_interval,
+                textfile=config["pidi"].get("metrics_file"),
+            )
 
     def start(self):
         if self._thread is not None:
             return
 
+        self._blanked = False
+        self.mark_dirty(*ALL_REGIONS)
         self._running = threading.Event()
         self._running.set()
         self._thread = threading.Thread(target=self._loop)
         self._thread.start()
+        if self._metrics_reporter is not None:
+            self._metrics_reporter.start()
 
     def stop(self):
         self._running.clear()
+        with self._wake:
+            self._wake.notify_all()
         self._thread.join()
         self._thread = None
         self._display.stop()
+        self._brainz.shutdown()
+        if self._metrics_reporter is not None:
+            self._metrics_reporter.stop()
+
+    def mark_dirty(self, *regions):
+        """Flag display regions as needing a redraw and wake the loop.
+
+        A blanked panel is left asleep, the regions are drawn once it wakes.
+
+        """
+        with self._wake:
+            self._dirty.update(regions)
+            if not self._blanked:
+                self._wake.notify()
+
+    def _take_dirty(self):
+        with self._wake:
+            dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def _handle_album_art(self, art, generation=None):
+        with self._art_lock:
+            if generation is not None and generation != self._art_generation:
+                # Art for a track we've since moved on from, skip the decode
+                return
+            requested_at, self._art_requested_at = self._art_requested_at, None
 
-    def _handle_album_art(self, art):
         if art != self._last_art:
-            self._display.update_album_art(art)
+            art_image = None
+            if self._art_images is not None:
+                art_image = self._get_art_image(art)
+
+            if art_image is not None:
+                self._display.update_album_art_image(art_image)
+            else:
+                self._display.update_album_art(art)
             self._last_art = art
+            self.mark_dirty(REGION_ART)
+
+        if requested_at is not None:
+            art_update_seconds.observe(time.monotonic() - requested_at)
+
+    def _get_art_image(self, art):
+        art_image = self._art_images.get(art)
+        if art_image is None:
+            try:
+                art_image = image.load_album_art(art, self.display_config.size)
+            except (OSError, ValueError) as err:
+                # Leave the display to make what it can of the file
+                logger.info(f"mopidy-pidi: unable to decode album art {art}: {err}")
+                return None
+            self._art_images.put(art, art_image)
+        # Hand the display a copy so it can't modify the cached frame
+        return art_image.copy()
 
     def update_album_art(self, art=None):
-        _album = self.title if self.album is None or self.album == "" else self.album
+        """Show the album art for the current track.
+
+        art may be a pykka future, such as from LibraryImages, in which case
+        it is waited on in the art worker pool rather than by the caller.
+
+        """
+        state = self._state
+        _album = (
+            state.title if state.album is None or state.album == "" else state.album
+        )
+        artist = state.artist
+
+        with self._art_lock:
+            self._art_generation += 1
+            generation = self._art_generation
+            self._art_requested_at = time.monotonic()
+            if self._art_future is not None:
+                # Drop the previous track's lookup if it hasn't started yet
+                self._brainz.cancel(self._art_future)
+                self._art_future = None
+
+        if isinstance(art, pykka.Future):
+            self._track_art_future(
+                generation,
+                self._brainz.submit(
+                    self._resolve_album_art, art, artist, _album, generation
+                ),
+            )
+            return
+
+        self._request_album_art(art, artist, _album, generation)
+
+    def _resolve_album_art(self, art, artist, album, generation):
+        art = self._get_art_future(art)
+        if generation == self._art_generation:
+            self._request_album_art(art, artist, album, generation)
+
+    def _get_art_future(self, art):
+        try:
+            return art.get(timeout=self.art_resolve_timeout)
+        except Exception as err:
+            logger.info(f"mopidy-pidi: unable to get album art from library: {err}")
+            return None
+
+    def _request_album_art(self, art, artist, album, generation):
+        def callback(art):
+            self._handle_album_art(art, generation)
+
+        def request_brainz_art():
+            self._track_art_future(
+                generation, self._brainz.get_album_art(artist, album, callback)
+            )
+
+        def fallback_callback(file_name):
+            if file_name is None:
+                # The art couldn't be read or downloaded, fall back to
+                # searching MusicBrainz
+                if generation == self._art_generation:
+                    request_brainz_art()
+            else:
+                callback(file_name)
 
         if art is not None:
             if os.path.isfile(art):
-                # Art is already a locally cached file we can use
-                self._handle_album_art(art)
+                # Art is already a local file, but may need resizing or
+                # extracting from the tags of an audio file
+                self._track_art_future(
+                    generation, self._brainz.get_file_art(art, fallback_callback)
+                )
                 return
 
             elif art.startswith("http://") or art.startswith("https://"):
-                file_name = self._brainz.get_cache_file_name(art)
+                # Download in the background so a slow server can't hold
+                # up the frontend actor.
+                self._track_art_future(
+                    generation, self._brainz.get_url_art(art, fallback_callback)
+                )
+                return
+
+        request_brainz_art()
 
-                if os.path.isfile(file_name):
-                    # If a cached file already exists, use it!
-                    self._handle_album_art(file_name)
-                    return
+    def prefetch_album_art(self, artist, album, art=None):
+        """Warm the art cache for an upcoming track at low priority."""
+        if isinstance(art, pykka.Future):
+            self._brainz.submit(
+                self._resolve_prefetch, art, artist, album, prefetch=True
+            )
+            return
+
+        if art is not None:
+            if os.path.isfile(art):
+                self._brainz.get_file_art(art, prefetch=True)
+                return
+
+            elif art.startswith("http://") or art.startswith("https://"):
+                self._brainz.get_url_art(art, prefetch=True)
+                return
 
-                else:
-                    # Otherwise, request the URL and save it!
-                    response = requests.get(art)
-                    if response.status_code == 200:
-                        self._brainz.save_album_art(response.content, file_name)
-                        self._handle_album_art(file_name)
-                        return
+        self._brainz.get_album_art(artist, album, prefetch=True)
 
-        art = self._brainz.get_album_art(self.artist, _album, self._handle_album_art)
+    def _resolve_prefetch(self, art, artist, album):
+        self.prefetch_album_art(artist, album, self._get_art_future(art))
+
+    def _track_art_future(self, generation, future):
+        """Remember a lookup so a later track change can cancel it."""
+        if future is None:
+            return
+
+        with self._art_lock:
+            if generation == self._art_generation:
+                self._art_future = future
 
     def update(self, **kwargs):
+        now = time.time()
         if "state" in kwargs or "volume" in kwargs:
-            self._last_state_change = time.time()
+            with self._wake:
+                self._last_state_change = now
+                if self._blanked:
+                    # Waking from idle means the panel needs a complete frame
+                    self._blanked = False
+                    self._dirty.update(ALL_REGIONS)
+                    self._wake.notify()
+
+        with self._state_lock:
+            state = self._state
+            changes = {
+                key: kwargs[key]
+                for key in UPDATE_REGIONS
+                if key in kwargs and kwargs[key] != getattr(state, key)
+            }
+            dirty = {UPDATE_REGIONS[key] for key in changes}
+
+            if "elapsed" in kwargs:
+                # Even if unchanged, restart interpolating the position
+                changes["elapsed_at"] = now
+
+            if not changes:
+                return
+            self._state = state._replace(version=state.version + 1, **changes)
+
+        if dirty:
+            self.mark_dirty(*dirty)
+
+    def _get_progress_pixel(self, progress=None):
+        """Return the progress bar position in whole display pixels."""
+        if progress is None:
+            progress = self._state.get_progress(time.time())
+        return int(progress * self.display_config.size)
+
+    def _get_frame_delay(self):
+        """Return the time in seconds until the next visible change.
+
+        While playing this is the time for the progress bar to advance by a
+        single pixel, and an idle timeout pulls the deadline in so the panel
+        is blanked on time. The result is clamped by min_fps and max_fps.
+
+        """
+        delay = self._max_delay
+        now = time.time()
+        state = self._state
+
+        if state.state == "play" and state.length:
+            elapsed = state.get_elapsed(now)
+            pixel_ms = float(state.length) / self.display_config.size
+            next_pixel_ms = (
+                self._get_progress_pixel(state.get_progress(now)) + 1
+            ) * pixel_ms
+            delay = min(delay, (next_pixel_ms - elapsed) / 1000.0)
+
+        if self.idle_timeout > 0:
+            t_idle_sec = now - self._last_state_change
+            if t_idle_sec < self.idle_timeout:
+                delay = min(delay, self.idle_timeout - t_idle_sec)
+
+        return max(self._min_delay, delay)
+
+    def _wait_for_frame(self):
+        with self._wake:
+            if (
+                not self._dirty
+                and self._state.version == self._rendered_version
+                and self._running.is_set()
+            ):
+                self._wake.wait(self._get_frame_delay())
+
+        # Don't exceed max_fps when a burst of updates arrives
+        t_frame_sec = time.time() - self._last_frame
+        if t_frame_sec < self._min_delay:
+            time.sleep(self._min_delay - t_frame_sec)
+        self._last_frame = time.time()
+
+    def _is_idle(self):
+        return (
+            self.idle_timeout > 0
+            and time.time() - self._last_state_change >= self.idle_timeout
+        )
+
+    def _sleep(self):
+        """Blank the panel until update brings a state or volume change.
+
+        The loop blocks without a timeout, so an idle display costs nothing
+        until it is woken.
+
+        """
+        with self._wake:
+            if not self._is_idle():
+                return
+            self._blanked = True
+
+        self._display.stop()
+        with self._wake:
+            while self._blanked and self._running.is_set():
+                self._wake.wait()
+
+        if self._running.is_set():
             self._display.start()
-        self.shuffle = kwargs.get("shuffle", self.shuffle)
-        self.repeat = kwargs.get("repeat", self.repeat)
-        self.state = kwargs.get("state", self.state)
-        self.volume = kwargs.get("volume", self.volume)
-        # self.progress = kwargs.get('progress', self.progress)
-        self.elapsed = kwargs.get("elapsed", self.elapsed)
-        self.length = kwargs.get("length", self.length)
-        self.title = kwargs.get("title", self.title)
-        self.album = kwargs.get("album", self.album)
-        self.artist = kwargs.get("artist", self.artist)
-
-        if "elapsed" in kwargs:
-            if "length" in kwargs:
-                self.progress = float(self.elapsed) / float(self.length)
-            self._last_elapsed_update = time.time()
-            self._last_elapsed_value = kwargs["elapsed"]
 
     def _loop(self):
+        self._display.start()
         while self._running.is_set():
-            t_idle_sec = time.time() - self._last_state_change
-            if self.idle_timeout > 0 and t_idle_sec >= self.idle_timeout:
-                self._display.stop()
-            elif self.state == "play":
-                t_elapsed_ms = (time.time() - self._last_elapsed_update) * 1000
-                self.elapsed = float(self._last_elapsed_value + t_elapsed_ms)
-                self.progress = self.elapsed / self.length
-            self._display.update_overlay(
-                self.shuffle,
-                self.repeat,
-                self.state,
-                self.volume,
-                self.progress,
-                self.elapsed,
-                self.title,
-                self.album,
-                self.artist,
-            )
-
-            self._display.redraw()
-            time.sleep(self._delay)
+            if self._is_idle():
+                self._sleep()
+                continue
+            self._render_frame()
+            self._wait_for_frame()
+
+    def _render_frame(self):
+        now = time.time()
+        # Only a visible step of the progress bar is worth a redraw
+        progress_pixel = self._get_progress_pixel(self._state.get_progress(now))
+        if progress_pixel != self._last_progress_pixel:
+            self._last_progress_pixel = progress_pixel
+            self.mark_dirty(REGION_PROGRESS)
+
+        # Taken before reading the state, which update replaces before
+        # marking regions dirty, so the frame is never older than its damage
+        dirty = self._take_dirty()
+        state = self._state
+        if dirty:
+            with redraw_seconds.time():
+                self._display.update_overlay(
+                    state.shuffle,
+                    state.repeat,
+                    state.state,
+                    state.volume,
+                    state.get_progress(now),
+                    state.get_elapsed(now),
+                    state.title,
+                    state.album,
+                    state.artist,
+                )
+                self._display.redraw_regions(frozenset(dirty))
+            frames.inc()
+        else:
+            frames_skipped.inc()
+        self._rendered_version = state.version
@@ -0,0 +1,111 @@
+"""
+Album art image processing.
+
+Pillow is provided by the display plugins rather than required by
+mopidy-pidi, so everything here degrades to passing the original image
+through untouched when it isn't installed.
+"""
+import io
+import logging
+import threading
+from collections import OrderedDict
+
+try:
+    from PIL import Image, ImageFilter
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Radius of the Gaussian blur applied to prepared album art
+BLUR_RADIUS = 5
+
+# Cover Art Archive thumbnail sizes, from smallest to largest
+THUMBNAIL_SIZES = (250, 500, 1200)
+
+
+def available():
+    """Return True if album art can be prepared for the display."""
+    return Image is not None
+
+
+def get_thumbnail_size(size):
+    """Return the smallest Cover Art Archive thumbnail covering size."""
+    for thumbnail_size in THUMBNAIL_SIZES:
+        if thumbnail_size >= size:
+            return thumbnail_size
+    return None
+
+
+def prepare_album_art(data, size, blur=False):
+    """Resize (and optionally blur) encoded album art to size x size.
+
+    Returns JPEG encoded bytes ready for the display, or the original data
+    if Pillow isn't installed or the image can't be decoded.
+
+    """
+    if Image is None:
+        return data
+
+    try:
+        image = Image.open(io.BytesIO(data))
+        image = image.convert("RGB").resize((size, size), Image.BICUBIC)
+    except (OSError, ValueError) as err:
+        logger.info(f"mopidy-pidi: unable to prepare album art: {err}")
+        return data
+
+    if blur:
+        image = image.filter(ImageFilter.GaussianBlur(radius=BLUR_RADIUS))
+
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+def load_album_art(input_file, size):
+    """Decode an album art file into a size x size RGB image."""
+    with Image.open(input_file) as image:
+        image = image.convert("RGB")
+        if image.size != (size, size):
+            image = image.resize((size, size), Image.BICUBIC)
+        return image
+
+
+class ImageCache:
+    """Memory bounded, least recently used cache of decoded images."""
+
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._images = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._images)
+
+    def get(self, key):
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+            return image
+
+    def put(self, key, image):
+        image_bytes = self._get_image_bytes(image)
+        if image_bytes > self._max_bytes:
+            return
+
+        with self._lock:
+            old_image = self._images.pop(key, None)
+            if old_image is not None:
+                self._total_bytes -= self._get_image_bytes(old_image)
+            self._images[key] = image
+            self._total_bytes += image_bytes
+
+            while self._total_bytes > self._max_bytes:
+                _, old_image = self._images.popitem(last=False)
+                self._total_bytes -= self._get_image_bytes(old_image)
+
+    def _get_image_bytes(self, image):
+        width, height = image.size
+        return width * height * len(image.getbands())
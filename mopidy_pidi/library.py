@@ -0,0 +1,86 @@
+"""
+Mopidy library lookups.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import pykka
+
+logger = logging.getLogger(__name__)
+
+
+class LibraryImages:
+    """Batched, memoized core.library.get_images lookups.
+
+    Images are cached per URI for ttl seconds, so replaying or re-queueing a
+    track doesn't need another round-trip through the core actor.
+
+    """
+
+    def __init__(self, library, ttl=3600, max_entries=1000):
+        self._library = library
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        # URI -> (expiry time, images), oldest first
+        self._images = OrderedDict()
+        # URI -> pykka future of the get_images call fetching it
+        self._pending = {}
+
+    def get_images(self, uris):
+        """Return a pykka future of {uri: images} for every URI in uris.
+
+        Cached URIs are answered without asking the library. The rest are
+        fetched with a single get_images call, shared with any lookup that
+        is already waiting on the same URIs. The future never blocks until
+        get() is called on it.
+
+        """
+        now = time.monotonic()
+        images = {}
+        pending = {}
+        missing = []
+
+        with self._lock:
+            for uri in uris:
+                entry = self._images.get(uri)
+                if entry is not None and entry[0] > now:
+                    images[uri] = entry[1]
+                elif uri in self._pending:
+                    pending[uri] = self._pending[uri]
+                else:
+                    missing.append(uri)
+
+            if missing:
+                future = self._library.get_images(missing)
+                for uri in missing:
+                    self._pending[uri] = future
+                    pending[uri] = future
+
+        def get(timeout=None):
+            for uri, future in pending.items():
+                try:
+                    result = future.get(timeout=timeout)
+                finally:
+                    self._release_pending(uri, future)
+                images[uri] = result.get(uri, ())
+                self._store(uri, images[uri])
+            return images
+
+        future = pykka.ThreadingFuture()
+        future.set_get_hook(get)
+        return future
+
+    def _release_pending(self, uri, future):
+        with self._lock:
+            if self._pending.get(uri) is future:
+                del self._pending[uri]
+
+    def _store(self, uri, images):
+        with self._lock:
+            self._images.pop(uri, None)
+            self._images[uri] = (time.monotonic() + self._ttl, images)
+            while len(self._images) > self._max_entries:
+                self._images.popitem(last=False)
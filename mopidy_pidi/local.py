@@ -0,0 +1,183 @@
+"""
+Album art for local files, found without a network lookup.
+
+Embedded art is read with mutagen when it is installed, otherwise only
+images alongside the music are used.
+"""
+import base64
+import logging
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+
+try:
+    import mutagen
+    from mutagen.flac import Picture
+except ImportError:
+    mutagen = None
+
+logger = logging.getLogger(__name__)
+
+# Images alongside the music that hold its album art, in order of preference
+ART_FILE_NAMES = (
+    "cover.jpg",
+    "cover.jpeg",
+    "cover.png",
+    "folder.jpg",
+    "folder.jpeg",
+    "folder.png",
+    "front.jpg",
+    "front.png",
+    "album.jpg",
+    "album.png",
+)
+
+# ID3 and FLAC picture type of the front cover
+PICTURE_TYPE_FRONT_COVER = 3
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp")
+
+
+def is_image_file(path):
+    """Return True if path is named like an image rather than audio."""
+    return path.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def read_embedded_art(path):
+    """Return the art embedded in the tags of an audio file, or None."""
+    if mutagen is None:
+        return None
+
+    try:
+        audio = mutagen.File(path)
+    except (mutagen.MutagenError, OSError) as err:
+        logger.info(f"mopidy-pidi: unable to read tags from {path}: {err}")
+        return None
+
+    if audio is None:
+        return None
+
+    # FLAC
+    pictures = getattr(audio, "pictures", None)
+    if pictures:
+        return _get_front_cover(pictures).data
+
+    tags = audio.tags
+    if tags is None:
+        return None
+
+    # ID3, in MP3, AIFF and WAV files
+    if hasattr(tags, "getall"):
+        pictures = tags.getall("APIC")
+        if pictures:
+            return _get_front_cover(pictures).data
+        return None
+
+    # MP4
+    covers = tags.get("covr")
+    if covers:
+        return bytes(covers[0])
+
+    # Ogg Vorbis and Opus
+    pictures = []
+    for picture in tags.get("metadata_block_picture", []):
+        try:
+            pictures.append(Picture(base64.b64decode(picture)))
+        except (ValueError, mutagen.MutagenError):
+            continue
+    if pictures:
+        return _get_front_cover(pictures).data
+
+    return None
+
+
+def _get_front_cover(pictures):
+    for picture in pictures:
+        if picture.type == PICTURE_TYPE_FRONT_COVER:
+            return picture
+    return pictures[0]
+
+
+class LocalArt:
+    """Find album art for file: and local: tracks on the local filesystem.
+
+    An image alongside the track, such as cover.jpg, is preferred over art
+    embedded in the track's tags. The images found are cached per directory
+    for ttl seconds, so the rest of an album is resolved without scanning it
+    again. Embedded art belongs to a single track, so is looked for in each.
+
+    """
+
+    def __init__(self, media_dir=None, ttl=3600, max_entries=1000):
+        self._media_dir = media_dir
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        # Directory -> (expiry time, image alongside its tracks), oldest first
+        self._art = OrderedDict()
+
+    def get_track_path(self, uri):
+        """Return the filesystem path of a track, or None if it isn't local."""
+        if uri.startswith("file:"):
+            return urllib.request.url2pathname(urllib.parse.urlsplit(uri).path)
+
+        if uri.startswith("local:track:") and self._media_dir is not None:
+            path = urllib.parse.unquote(uri[len("local:track:") :])
+            return os.path.join(self._media_dir, path)
+
+        return None
+
+    def find_art(self, uri):
+        """Return the path to local art for the track at uri, or None.
+
+        The path is either an image, or an audio file with art embedded in
+        its tags, which Brainz.get_file_art accepts in place of an image.
+
+        """
+        path = self.get_track_path(uri)
+        if path is None:
+            return None
+
+        art = self._get_directory_art(os.path.dirname(path))
+        if art is not None:
+            return art
+
+        if read_embedded_art(path) is not None:
+            return path
+
+        return None
+
+    def _get_directory_art(self, directory):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._art.get(directory)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+
+        art = self._find_directory_art(directory)
+
+        with self._lock:
+            self._art.pop(directory, None)
+            self._art[directory] = (now + self._ttl, art)
+            while len(self._art) > self._max_entries:
+                self._art.popitem(last=False)
+
+        return art
+
+    def _find_directory_art(self, directory):
+        try:
+            with os.scandir(directory) as it:
+                file_names = {
+                    entry.name.lower(): entry.path for entry in it if entry.is_file()
+                }
+        except OSError:
+            return None
+
+        for file_name in ART_FILE_NAMES:
+            if file_name in file_names:
+                return file_names[file_name]
+
+        return None
@@ -0,0 +1,214 @@
+"""
+Runtime metrics for the display and album art pipeline.
+
+Metrics are registered in the module level registry by the code they
+measure. A Reporter periodically logs a summary and can write them out in
+the Prometheus text format, for node_exporter's textfile collector.
+"""
+import bisect
+import contextlib
+import logging
+import math
+import threading
+import time
+
+from .cache import write_file
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the buckets used by histograms
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+
+
+class Counter:
+    """A value which only goes up."""
+
+    type = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def snapshot(self):
+        return self._value
+
+    def format(self):
+        return [f"{self.name} {self._value}"]
+
+
+class Histogram:
+    """Counts of observed values, bucketed by upper bound."""
+
+    type = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self._buckets = tuple(buckets)
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._sum = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect.bisect_left(self._buckets, value)] += 1
+            self._sum += value
+
+    @contextlib.contextmanager
+    def time(self):
+        """Observe the time taken by the body of a with statement."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "count": sum(self._counts),
+                "sum": self._sum,
+                "buckets": dict(zip(self._buckets + (math.inf,), self._counts)),
+            }
+
+    def format(self):
+        snapshot = self.snapshot()
+        lines = []
+        cumulative = 0
+        for bound, count in snapshot["buckets"].items():
+            cumulative += count
+            le = "+Inf" if bound == math.inf else f"{bound:g}"
+            lines.append(f'{self.name}_bucket{{le="{le}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {snapshot['sum']:.6f}")
+        lines.append(f"{self.name}_count {snapshot['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help):
+        return self._register(Counter, name, help)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help, buckets)
+
+    def snapshot(self):
+        """Return the current value of every metric, by name."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def format_prometheus(self):
+        """Return every metric in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.format())
+        return "\n".join(lines) + "\n"
+
+    def _register(self, cls, name, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args)
+            return metric
+
+
+registry = Registry()
+
+
+class Reporter:
+    """Log a summary of the metrics, and write them to a textfile.
+
+    Runs every interval seconds from start until stop. The textfile is
+    replaced atomically so a collector never reads it half written.
+
+    """
+
+    def __init__(self, registry, interval, textfile=None):
+        self._registry = registry
+        self._interval = interval
+        self._textfile = textfile
+        self._stopped = threading.Event()
+        self._thread = None
+        self._last_snapshot = registry.snapshot()
+        self._last_report = time.monotonic()
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._loop, name="pidi-metrics", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def report(self):
+        now = time.monotonic()
+        snapshot = self._registry.snapshot()
+        logger.info(
+            "mopidy-pidi: "
+            + self.format_summary(
+                snapshot, self._last_snapshot, now - self._last_report
+            )
+        )
+        self._last_snapshot = snapshot
+        self._last_report = now
+
+        if self._textfile is not None:
+            try:
+                write_file(
+                    self._textfile,
+                    self._registry.format_prometheus().encode("utf-8"),
+                )
+            except OSError as err:
+                logger.warning(f"mopidy-pidi: unable to write metrics: {err}")
+
+    def format_summary(self, snapshot, last_snapshot, elapsed):
+        """Summarise what changed between two snapshots, elapsed seconds apart."""
+
+        def delta(name):
+            return snapshot.get(name, 0) - last_snapshot.get(name, 0)
+
+        def mean_ms(name):
+            empty = {"count": 0, "sum": 0}
+            value = snapshot.get(name, empty)
+            last_value = last_snapshot.get(name, empty)
+            count = value["count"] - last_value["count"]
+            total = value["sum"] - last_value["sum"]
+            return total / count * 1000 if count else 0
+
+        frames = delta("pidi_frames_total")
+        return (
+            f"{frames / elapsed if elapsed > 0 else 0:.2f} fps, "
+            f"{delta('pidi_frames_skipped_total')} skipped, "
+            f"redraw {mean_ms('pidi_redraw_seconds'):.1f}ms, "
+            f"art cache {delta('pidi_art_cache_hits_total')} hits "
+            f"{delta('pidi_art_cache_misses_total')} misses, "
+            f"musicbrainz {mean_ms('pidi_musicbrainz_request_seconds'):.0f}ms "
+            f"{delta('pidi_musicbrainz_retries_total')} retries "
+            f"{delta('pidi_musicbrainz_failures_total')} failures, "
+            f"downloaded {delta('pidi_art_download_bytes_total')} bytes "
+            f"in {mean_ms('pidi_art_download_seconds'):.0f}ms, "
+            f"art shown in {mean_ms('pidi_art_update_seconds'):.0f}ms"
+        )
+
+    def _loop(self):
+        while not self._stopped.wait(self._interval):
+            self.report()
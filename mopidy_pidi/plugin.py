@@ -1,6 +1,18 @@
+# Regions of the display which can be redrawn independently
+REGION_ART = "art"
+REGION_TEXT = "text"
+REGION_PROGRESS = "progress"
+REGION_STATE = "state"
+
+ALL_REGIONS = frozenset((REGION_ART, REGION_TEXT, REGION_PROGRESS, REGION_STATE))
+
+
 class Display:
     """Base class to represent a Pirate Display display output."""
 
+    # Set to True by displays that implement update_album_art_image
+    supports_album_art_image = False
+
     def __init__(self, args=None):
         """Initialise a new display."""
         self._size = args.size
@@ -26,6 +38,17 @@ class Display:
         """Update the display album art."""
         raise NotImplementedError
 
+    def update_album_art_image(self, image):
+        """Update the display album art from a decoded PIL Image.
+
+        The image is RGB and already sized to fit the display. This is used
+        in place of update_album_art when supports_album_art_image is True,
+        saving the display a decode when recently shown art comes around
+        again.
+
+        """
+        raise NotImplementedError
+
     def update_overlay(
         self, shuffle, repeat, state, volume, progress, elapsed, title, album, artist
     ):
@@ -44,6 +67,16 @@ class Display:
         """Redraw the display."""
         raise NotImplementedError
 
+    def redraw_regions(self, regions):
+        """Redraw the regions of the display that have changed.
+
+        regions is a frozenset of the REGION_ constants. Displays which can
+        update part of the panel, such as by setting a window before sending
+        pixel data, should override this to send only those regions.
+
+        """
+        self.redraw()
+
     def add_args(argparse):
         """Expand argparse instance with display-specific args."""
 
@@ -52,9 +85,22 @@ class DisplayDummy(Display):
     """Dummy display for use in texting."""
 
     option_name = "dummy"
+    supports_album_art_image = True
+
+    def __init__(self, args=None):
+        super().__init__(args)
+        # The regions passed to each redraw, so tests can check them
+        self.damage = []
 
     def update_album_art(self, input_file):
         pass
 
+    def update_album_art_image(self, image):
+        pass
+
     def redraw(self):
         pass
+
+    def redraw_regions(self, regions):
+        self.damage.append(regions)
+        self.redraw()
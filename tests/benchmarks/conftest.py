@@ -0,0 +1,99 @@
+import io
+import json
+import os
+import platform
+import time
+from unittest import mock
+
+import mopidy_pidi
+import pytest
+from mopidy_pidi import cache, image, metrics
+
+# Benchmarks only run when given a file to write their results to, e.g.
+# PIDI_BENCHMARK_JSON=benchmark.json python -m pytest tests/benchmarks
+RESULTS_ENV = "PIDI_BENCHMARK_JSON"
+
+
+@pytest.fixture(autouse=True)
+def require_results_file():
+    if not os.environ.get(RESULTS_ENV):
+        pytest.skip(f"set {RESULTS_ENV} to run benchmarks")
+
+
+@pytest.fixture(scope="session")
+def benchmark_results():
+    results = {}
+    yield results
+
+    if not results:
+        return
+
+    with open(os.environ[RESULTS_ENV], "w") as f:
+        json.dump(
+            {
+                "version": mopidy_pidi.__version__,
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "timestamp": time.time(),
+                "results": results,
+            },
+            f,
+            indent=2,
+            sort_keys=True,
+        )
+
+
+@pytest.fixture
+def config(tmp_path):
+    return {
+        "pidi": {"display": "dummy", "idle_timeout": 0},
+        "core": {"data_dir": str(tmp_path)},
+    }
+
+
+@pytest.fixture
+def dummy_display():
+    """Make DisplayDummy available as the "dummy" display plugin."""
+    entry_point = mopidy_pidi.metadata.EntryPoint(
+        name="dummy",
+        value="mopidy_pidi.plugin:DisplayDummy",
+        group=mopidy_pidi.DISPLAY_ENTRY_POINT,
+    )
+    mopidy_pidi.Extension.get_display_class.cache_clear()
+    with mock.patch.object(
+        mopidy_pidi, "get_display_entry_points", return_value={"dummy": entry_point}
+    ):
+        yield
+    mopidy_pidi.Extension.get_display_class.cache_clear()
+
+
+@pytest.fixture
+def metrics_delta():
+    """Return a function giving the change in each metric since the test began."""
+    start = metrics.registry.snapshot()
+
+    def delta():
+        result = {}
+        for name, value in metrics.registry.snapshot().items():
+            start_value = start.get(name)
+            if isinstance(value, dict):
+                start_value = start_value or {"count": 0, "sum": 0}
+                result[name] = {
+                    "count": value["count"] - start_value["count"],
+                    "sum": value["sum"] - start_value["sum"],
+                }
+            else:
+                result[name] = value - (start_value or 0)
+        return result
+
+    return delta
+
+
+def make_cover(colour="red", size=500):
+    """Return encoded album art, a real JPEG if Pillow is installed."""
+    if not image.available():
+        return cache.JPEG_START + bytes(size) + cache.JPEG_END
+
+    output = io.BytesIO()
+    image.Image.new("RGB", (size, size), colour).save(output, format="JPEG")
+    return output.getvalue()
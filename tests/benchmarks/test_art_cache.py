@@ -0,0 +1,82 @@
+import json
+import os
+import random
+import time
+
+import pytest
+from mopidy_pidi import cache
+
+SIZES = [
+    int(size)
+    for size in os.environ.get("PIDI_BENCHMARK_CACHE_SIZES", "10000,100000").split(",")
+]
+
+LOOKUPS = 1000
+
+
+def populate(cache_dir, size):
+    """Fill cache_dir with size art files, without an index."""
+    art = cache.JPEG_START + bytes(64) + cache.JPEG_END
+    art_cache = cache.ArtCache(cache_dir)
+    keys = [f"Artist {i}-Album {i}" for i in range(size)]
+    for key in keys:
+        # Skip put's fsyncs, which would dominate populating the cache
+        with open(art_cache.get_path(key), "wb") as f:
+            f.write(art)
+    os.remove(os.path.join(cache_dir, cache.ArtCache.index_name))
+    return keys
+
+
+def mark_unclean(cache_dir):
+    index_file = os.path.join(cache_dir, cache.ArtCache.index_name)
+    with open(index_file) as f:
+        index = json.load(f)
+    index["clean"] = False
+    with open(index_file, "w") as f:
+        json.dump(index, f)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def lookup_all(art_cache, keys):
+    for key in keys:
+        art_cache.get(key)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_art_cache(size, tmp_path, benchmark_results):
+    cache_dir = str(tmp_path)
+    keys = populate(cache_dir, size)
+    hits = random.sample(keys, min(LOOKUPS, size))
+    misses = [f"Missing {i}" for i in range(LOOKUPS)]
+
+    rebuild_sec, art_cache = timed(cache.ArtCache, cache_dir)
+    assert len(art_cache) == size
+    art_cache.close()
+
+    mark_unclean(cache_dir)
+    unclean_load_sec, art_cache = timed(cache.ArtCache, cache_dir)
+    art_cache.close()
+    load_sec, art_cache = timed(cache.ArtCache, cache_dir)
+
+    # The first lookups after a restart read each file's head and tail
+    # from disk, later ones are served from the page cache
+    cold_sec, _ = timed(lookup_all, art_cache, hits)
+    warm_sec, _ = timed(lookup_all, art_cache, hits)
+    miss_sec, _ = timed(lookup_all, art_cache, misses)
+    flush_sec, _ = timed(art_cache.flush)
+    art_cache.close()
+
+    benchmark_results.setdefault("art_cache", {})[str(size)] = {
+        "rebuild_sec": rebuild_sec,
+        "load_sec": load_sec,
+        "unclean_load_sec": unclean_load_sec,
+        "cold_lookup_ms": cold_sec / len(hits) * 1000,
+        "warm_lookup_ms": warm_sec / len(hits) * 1000,
+        "miss_lookup_ms": miss_sec / len(misses) * 1000,
+        "flush_sec": flush_sec,
+    }
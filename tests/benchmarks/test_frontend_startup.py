@@ -0,0 +1,35 @@
+import timeit
+
+import pykka
+from mopidy import core
+
+from mopidy_pidi.frontend import PiDiFrontend
+
+from .. import dummy_audio, dummy_backend, dummy_mixer
+
+
+def test_frontend_startup(config, dummy_display, benchmark_results):
+    def start_core():
+        mixer = dummy_mixer.create_proxy()
+        audio = dummy_audio.create_proxy()
+        backend = dummy_backend.create_proxy(audio=audio)
+        dummy_core = core.Core.start(audio=audio, mixer=mixer, backends=[backend])
+        # Returns once the core is running
+        dummy_core.proxy().get_version().get()
+        return dummy_core
+
+    def without_pidi():
+        start_core()
+        pykka.ActorRegistry.stop_all()
+
+    def with_pidi():
+        dummy_core = start_core()
+        frontend = PiDiFrontend.start(config, dummy_core.proxy())
+        # Returns once on_start has brought up the display
+        frontend.proxy().settle_events().get()
+        pykka.ActorRegistry.stop_all()
+
+    benchmark_results["frontend_startup"] = {
+        "without_pidi_sec": min(timeit.repeat(without_pidi, number=1, repeat=5)),
+        "with_pidi_sec": min(timeit.repeat(with_pidi, number=1, repeat=5)),
+    }
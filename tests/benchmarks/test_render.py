@@ -0,0 +1,55 @@
+import os
+import time
+
+import pytest
+from mopidy_pidi import frontend as frontend_lib
+
+# Seconds to measure each idle state for
+DURATION = float(os.environ.get("PIDI_BENCHMARK_IDLE_SECONDS", 10))
+
+TRACK_LENGTH = 180000.0
+
+IDLE_STATES = {
+    "stopped": {"state": "stop"},
+    "paused": {"state": "pause", "elapsed": 60000.0, "length": TRACK_LENGTH},
+    "playing": {"state": "play", "elapsed": 60000.0, "length": TRACK_LENGTH},
+    # Blanked by the idle timeout straight after the update
+    "blanked": {"state": "stop"},
+}
+
+
+@pytest.mark.parametrize("name", IDLE_STATES)
+def test_idle_cpu(name, config, dummy_display, metrics_delta, benchmark_results):
+    if name == "blanked":
+        config["pidi"]["idle_timeout"] = 1
+
+    display = frontend_lib.PiDi(config)
+    display.start()
+    try:
+        display.update(title="Title", album="Album", artist="Artist", volume=50)
+        display.update(**IDLE_STATES[name])
+        # Let the first frames, and any idle timeout, pass
+        time.sleep(config["pidi"]["idle_timeout"] + 1)
+
+        metrics_start = metrics_delta()
+        cpu_start = time.process_time()
+        time.sleep(DURATION)
+        cpu = time.process_time() - cpu_start
+        metrics_end = metrics_delta()
+    finally:
+        display.stop()
+
+    def per_minute(value):
+        return value / DURATION * 60
+
+    frames = metrics_end["pidi_frames_total"] - metrics_start["pidi_frames_total"]
+    skipped = (
+        metrics_end["pidi_frames_skipped_total"]
+        - metrics_start["pidi_frames_skipped_total"]
+    )
+    benchmark_results.setdefault("idle", {})[name] = {
+        "cpu_sec_per_min": per_minute(cpu),
+        "frames_per_min": per_minute(frames),
+        "wakeups_per_min": per_minute(frames + skipped),
+        "duration_sec": DURATION,
+    }
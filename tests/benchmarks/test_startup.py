@@ -0,0 +1,104 @@
+import subprocess
+import sys
+import timeit
+from unittest import mock
+
+import mopidy_pidi
+import pytest
+from mopidy_pidi import Extension
+
+ROUNDS = 20
+
+
+# Display plugins installed alongside the selected one, each taking
+# this long to import, like a plugin pulling in a hardware library
+OTHER_DISPLAYS = 3
+OTHER_IMPORT_SEC = 0.02
+
+STUB_DISPLAY = """
+import time
+
+from mopidy_pidi import plugin
+
+time.sleep({import_sec})
+
+
+class Display(plugin.Display):
+    option_name = "{name}"
+"""
+
+
+@pytest.fixture
+def stub_displays(tmp_path, monkeypatch):
+    """Register stub display plugins, returning the name of the selected one."""
+    names = ["selected"] + [f"other{i}" for i in range(OTHER_DISPLAYS)]
+    entry_points = {}
+    for name in names:
+        import_sec = 0 if name == "selected" else OTHER_IMPORT_SEC
+        module = f"pidi_benchmark_{name}"
+        (tmp_path / f"{module}.py").write_text(
+            STUB_DISPLAY.format(name=name, import_sec=import_sec)
+        )
+        entry_points[name] = mopidy_pidi.metadata.EntryPoint(
+            name=name, value=f"{module}:Display", group=mopidy_pidi.DISPLAY_ENTRY_POINT
+        )
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    def unload():
+        for name in names:
+            sys.modules.pop(f"pidi_benchmark_{name}", None)
+
+    Extension.get_display_class.cache_clear()
+    with mock.patch.object(
+        mopidy_pidi, "get_display_entry_points", return_value=entry_points
+    ):
+        yield "selected", unload
+    unload()
+    Extension.get_display_class.cache_clear()
+
+
+def legacy_get_display_types():
+    """Display discovery as it was before plugins were loaded lazily."""
+    display_types = {}
+    for entry_point in mopidy_pidi.get_display_entry_points().values():
+        plugin = entry_point.load()
+        display_types[plugin.option_name] = plugin
+    return display_types
+
+
+def test_display_discovery(stub_displays, benchmark_results):
+    display, unload = stub_displays
+
+    def legacy():
+        # Once for get_config_schema and again in PiDi.__init__
+        legacy_get_display_types()
+        legacy_get_display_types()
+
+    def lazy():
+        Extension.get_display_class.cache_clear()
+        Extension().get_config_schema()
+        assert Extension.get_display_class(display).option_name == display
+
+    def timed(fn):
+        # Start each round as a fresh Mopidy process would, with nothing
+        # imported yet
+        return min(timeit.repeat(fn, setup=unload, number=1, repeat=ROUNDS))
+
+    benchmark_results["display_discovery"] = {
+        "legacy_sec": timed(legacy),
+        "lazy_sec": timed(lazy),
+        "displays": OTHER_DISPLAYS + 1,
+        "other_import_sec": OTHER_IMPORT_SEC,
+    }
+
+
+def test_import_time(benchmark_results):
+    def import_extension():
+        subprocess.run(
+            [sys.executable, "-c", "import mopidy_pidi; mopidy_pidi.Extension()"],
+            check=True,
+        )
+
+    benchmark_results["import"] = {
+        "sec": min(timeit.repeat(import_extension, number=1, repeat=5)),
+    }
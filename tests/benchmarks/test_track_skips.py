@@ -0,0 +1,185 @@
+import http.server
+import threading
+import time
+from unittest import mock
+
+import pykka
+from mopidy import core
+from mopidy.models import Album, Artist, Image, TlTrack, Track
+
+import pytest
+from mopidy_pidi import brainz as brainz_lib
+from mopidy_pidi import frontend as frontend_lib
+from mopidy_pidi import plugin as plugin_lib
+
+from .. import dummy_audio, dummy_backend, dummy_mixer
+from .conftest import make_cover
+
+SKIPS = 300
+SKIPS_PER_SEC = 100
+
+# Seconds taken by each stubbed MusicBrainz request
+MUSICBRAINZ_LATENCY = 0.05
+
+# Seconds without an art update after which the display is settled
+QUIET_SEC = 2
+TIMEOUT_SEC = 30
+
+
+class CoverHandler(http.server.BaseHTTPRequestHandler):
+    cover = make_cover()
+
+    def do_GET(self):  # noqa: N802
+        self.server.paths.append(self.path)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(self.cover)))
+        self.end_headers()
+        self.wfile.write(self.cover)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def cover_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), CoverHandler)
+    server.paths = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def musicbrainz():
+    """Stand in for MusicBrainz, recording the searches made."""
+    searches = []
+    cover = make_cover("blue")
+
+    def search_releases(artist, release, limit):
+        searches.append((artist, release))
+        time.sleep(MUSICBRAINZ_LATENCY)
+        return {"release-list": [{"release-group": {"id": release}}]}
+
+    def get_release_group_image_front(release_id, size):
+        time.sleep(MUSICBRAINZ_LATENCY)
+        return cover
+
+    with mock.patch.object(
+        brainz_lib.mus, "search_releases", side_effect=search_releases
+    ), mock.patch.object(
+        brainz_lib.mus,
+        "get_release_group_image_front",
+        side_effect=get_release_group_image_front,
+    ):
+        yield searches
+
+
+@pytest.fixture
+def art_updates():
+    """Record when the display is handed new album art."""
+    updates = []
+
+    def record(display, art):
+        updates.append(time.monotonic())
+
+    with mock.patch.object(
+        plugin_lib.DisplayDummy, "update_album_art", autospec=True, side_effect=record
+    ), mock.patch.object(
+        plugin_lib.DisplayDummy,
+        "update_album_art_image",
+        autospec=True,
+        side_effect=record,
+    ):
+        yield updates
+
+
+def make_tl_tracks(cover_server):
+    host, port = cover_server.server_address
+    tl_tracks = []
+    images = {}
+    for i in range(SKIPS):
+        track = Track(
+            uri=f"dummy:track:{i}",
+            name=f"Track {i}",
+            album=Album(name=f"Album {i}"),
+            artists=[Artist(name="Artist")],
+            length=180000,
+        )
+        tl_tracks.append(TlTrack(tlid=i, track=track))
+        # Every other track has to fall back to MusicBrainz
+        if i % 2 == 0:
+            images[track.uri] = [
+                Image(uri=f"http://{host}:{port}/{i}.jpg", width=500, height=500)
+            ]
+    return tl_tracks, images
+
+
+def test_track_skip_storm(
+    config,
+    dummy_display,
+    cover_server,
+    musicbrainz,
+    art_updates,
+    metrics_delta,
+    benchmark_results,
+):
+    tl_tracks, images = make_tl_tracks(cover_server)
+
+    def get_images(provider, uris):
+        return {uri: images.get(uri, []) for uri in uris}
+
+    with mock.patch.object(
+        dummy_backend.DummyLibraryProvider,
+        "get_images",
+        autospec=True,
+        side_effect=get_images,
+    ):
+        mixer = dummy_mixer.create_proxy()
+        audio = dummy_audio.create_proxy()
+        backend = dummy_backend.create_proxy(audio=audio)
+        dummy_core = core.Core.start(
+            audio=audio, mixer=mixer, backends=[backend]
+        ).proxy()
+        frontend = frontend_lib.PiDiFrontend.start(config, dummy_core).proxy()
+        try:
+            # Wait for on_start, and the art it shows
+            frontend.settle_events().get()
+            time.sleep(QUIET_SEC)
+            del art_updates[:]
+
+            cpu_start = time.process_time()
+            start = time.monotonic()
+            for i, tl_track in enumerate(tl_tracks):
+                # The core ends each track just before starting the next
+                if i > 0:
+                    frontend.track_playback_ended(tl_tracks[i - 1], 1000)
+                frontend.track_playback_started(tl_track)
+                delay = start + (i + 1) / SKIPS_PER_SEC - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            last_skip = time.monotonic()
+
+            while time.monotonic() - last_skip < TIMEOUT_SEC:
+                last_update = art_updates[-1] if art_updates else last_skip
+                if time.monotonic() - last_update >= QUIET_SEC:
+                    break
+                time.sleep(0.1)
+            cpu = time.process_time() - cpu_start
+        finally:
+            pykka.ActorRegistry.stop_all()
+
+    result = metrics_delta()
+    benchmark_results["track_skips"] = {
+        "skips": SKIPS,
+        "skips_per_sec": SKIPS / (last_skip - start),
+        "cpu_sec": cpu,
+        "art_updates": len(art_updates),
+        "settle_sec": art_updates[-1] - last_skip if art_updates else None,
+        "http_requests": len(cover_server.paths),
+        "musicbrainz_searches": len(musicbrainz),
+        "art_cache_misses": result["pidi_art_cache_misses_total"],
+        "frames": result["pidi_frames_total"],
+    }
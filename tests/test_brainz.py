@@ -0,0 +1,322 @@
+import errno
+import os
+import threading
+from unittest import mock
+
+import pytest
+from mopidy_pidi import brainz as brainz_lib
+
+
+@pytest.fixture
+def brainz(tmp_path):
+    brainz = brainz_lib.Brainz(cache_dir=str(tmp_path))
+    # Don't let the shared MusicBrainz rate limit slow the tests down
+    brainz.rate_limiter = mock.Mock()
+    yield brainz
+    brainz.shutdown()
+
+
+def test_get_album_art_without_artist_returns_default(brainz):
+    assert brainz.get_album_art("", "Album") == brainz._default_filename
+
+
+def test_concurrent_requests_share_one_lookup(brainz):
+    release = threading.Event()
+
+    def request_album_art(artist, album, size=None):
+        release.wait(5)
+        return b"cover"
+
+    with mock.patch.object(
+        brainz, "request_album_art", side_effect=request_album_art
+    ) as request:
+        first = brainz.get_album_art("Artist", "Album", callback=lambda f: None)
+        second = brainz.get_album_art("Artist", "Album", callback=lambda f: None)
+        release.set()
+
+        assert first is second
+        assert first.result(5) == brainz.get_cache_file_name("Artist_Album")
+        request.assert_called_once_with("Artist", "Album", size=500)
+
+
+def test_failed_lookup_is_remembered_as_a_miss(brainz):
+    with mock.patch.object(brainz, "request_album_art", return_value=None) as request:
+        first = brainz.get_album_art("Artist", "Album")
+        second = brainz.get_album_art("Artist", "Album")
+
+    assert first == second == brainz._default_filename
+    request.assert_called_once()
+    assert not os.path.exists(brainz.get_cache_file_name("Artist_Album"))
+
+
+def test_cancel_queued_lookup_skips_callback(brainz):
+    release = threading.Event()
+    callback = mock.Mock()
+
+    def request_album_art(artist, album, size=None):
+        release.wait(5)
+        return b"cover"
+
+    with mock.patch.object(brainz, "request_album_art", side_effect=request_album_art):
+        # Occupy every worker so the final lookup stays queued
+        busy = [
+            brainz.get_album_art(f"Artist {i}", "Album", callback=lambda f: None)
+            for i in range(brainz.max_workers)
+        ]
+        queued = brainz.get_album_art("Artist", "Album", callback=callback)
+
+        assert brainz.cancel(queued)
+        release.set()
+        for future in busy:
+            future.result(5)
+
+    callback.assert_not_called()
+    assert queued not in brainz._in_flight.values()
+
+
+def test_get_url_art_downloads_to_cache(brainz):
+    url = "https://example.com/cover.jpg"
+    response = mock.Mock(status_code=200, content=b"cover")
+
+    with mock.patch.object(brainz._session, "get", return_value=response) as get:
+        file_name = brainz.get_url_art(url)
+
+    get.assert_called_once_with(url, timeout=brainz.http_timeout)
+    assert file_name == brainz.get_cache_file_name(url)
+    with open(file_name, "rb") as f:
+        assert f.read() == b"cover"
+
+
+def test_get_url_art_failure_resolves_to_none(brainz):
+    called = threading.Event()
+    callback = mock.Mock(side_effect=lambda file_name: called.set())
+
+    with mock.patch.object(
+        brainz._session, "get", side_effect=brainz_lib.requests.ConnectionError
+    ):
+        brainz.get_url_art("https://example.com/cover.jpg", callback)
+        assert called.wait(5)
+
+    callback.assert_called_once_with(None)
+
+
+def test_art_that_cannot_be_cached_resolves_to_fallback(brainz):
+    called = threading.Event()
+    url_callback = mock.Mock(side_effect=lambda file_name: called.set())
+    response = mock.Mock(status_code=200, content=b"cover")
+    disk_full = OSError(errno.ENOSPC, "No space left on device")
+
+    with mock.patch.object(
+        brainz._session, "get", return_value=response
+    ), mock.patch.object(
+        brainz, "request_album_art", return_value=b"cover"
+    ), mock.patch.object(
+        brainz._cache, "put", side_effect=disk_full
+    ):
+        brainz.get_url_art("https://example.com/cover.jpg", url_callback)
+        assert called.wait(5)
+        album_art = brainz.get_album_art("Artist", "Album")
+
+    url_callback.assert_called_once_with(None)
+    assert album_art == brainz._default_filename
+
+
+def test_prepared_art_is_cached_per_display_size(tmp_path):
+    pytest.importorskip("PIL")
+    brainz = brainz_lib.Brainz(cache_dir=str(tmp_path), art_size=240)
+
+    with mock.patch.object(
+        brainz, "request_album_art", return_value=b"cover"
+    ) as request:
+        file_name = brainz.get_album_art("Artist", "Album")
+    brainz.shutdown()
+
+    request.assert_called_once_with("Artist", "Album", size=250)
+    assert file_name == brainz.get_cache_file_name("Artist_Album@240")
+
+
+def test_prefetch_does_not_wait_for_lookup(brainz):
+    release = threading.Event()
+
+    def request_album_art(artist, album, size=None):
+        release.wait(5)
+        return b"cover"
+
+    with mock.patch.object(brainz, "request_album_art", side_effect=request_album_art):
+        future = brainz.get_album_art("Artist", "Album", prefetch=True)
+        assert not future.done()
+        release.set()
+        assert future.result(5) == brainz.get_cache_file_name("Artist_Album")
+
+
+def test_request_promotes_queued_prefetch(brainz):
+    release = threading.Event()
+
+    def request_album_art(artist, album, size=None):
+        if artist == "Busy":
+            release.wait(5)
+        return b"cover"
+
+    with mock.patch.object(brainz, "request_album_art", side_effect=request_album_art):
+        # The single prefetch worker is busy, so this prefetch stays queued
+        brainz.get_album_art("Busy", "Album", prefetch=True)
+        queued = brainz.get_album_art("Artist", "Album", prefetch=True)
+
+        file_name = brainz.get_album_art("Artist", "Album")
+        release.set()
+
+    assert queued.cancelled()
+    assert file_name == brainz.get_cache_file_name("Artist_Album")
+
+
+@mock.patch.object(brainz_lib.time, "sleep")
+@mock.patch.object(brainz_lib.mus, "get_release_group_image_front")
+@mock.patch.object(brainz_lib.mus, "search_releases")
+def test_request_album_art_returns_result_of_retry(search, get_image, sleep, brainz):
+    search.side_effect = [
+        brainz_lib.mus.NetworkError(),
+        brainz_lib.mus.NetworkError(),
+        {"release-list": [{"release-group": {"id": "1234"}}]},
+    ]
+    get_image.return_value = b"cover"
+
+    assert brainz.request_album_art("Artist", "Album", retry_delay=1) == b"cover"
+    assert sleep.call_args_list == [mock.call(1), mock.call(2)]
+
+
+@mock.patch.object(brainz_lib.time, "sleep")
+@mock.patch.object(brainz_lib.mus, "search_releases")
+def test_request_album_art_gives_up(search, sleep, brainz):
+    search.side_effect = brainz_lib.mus.NetworkError()
+
+    assert brainz.request_album_art("Artist", "Album", retries=2) is None
+    assert search.call_count == 3
+
+
+@mock.patch.object(brainz_lib.mus, "search_releases")
+def test_request_album_art_without_release(search, brainz):
+    search.return_value = {"release-list": []}
+
+    assert brainz.request_album_art("Artist", "Album") is None
+
+
+def test_rate_limiter_spaces_out_requests():
+    rate_limiter = brainz_lib.RateLimiter(rate=1.0, burst=1)
+
+    with mock.patch.object(brainz_lib.time, "sleep") as sleep:
+        rate_limiter.acquire()
+        sleep.assert_not_called()
+        rate_limiter.acquire()
+
+    assert sleep.call_args.args[0] == pytest.approx(1.0, abs=0.1)
+
+
+def test_revalidate_expired_miss(brainz):
+    brainz.miss_ttl = 0
+    with mock.patch.object(brainz, "request_album_art", return_value=None):
+        brainz.get_album_art("Artist", "Album")
+
+    with mock.patch.object(
+        brainz, "request_album_art", return_value=b"cover"
+    ) as request:
+        assert brainz.revalidate_misses() == 1
+        brainz._prefetch_executor.submit(lambda: None).result(5)
+
+    request.assert_called_once_with("Artist", "Album", size=500)
+    assert brainz.get_album_art("Artist", "Album") == brainz.get_cache_file_name(
+        "Artist_Album"
+    )
+
+
+def test_revalidate_waits_for_idle_network(brainz):
+    brainz.miss_ttl = 0
+    with mock.patch.object(brainz, "request_album_art", return_value=None):
+        brainz.get_album_art("Artist", "Album")
+    brainz._in_flight["Busy_Album"] = mock.Mock()
+
+    assert brainz.revalidate_misses() == 0
+
+
+def test_art_fetched_by_another_instance_is_not_fetched_again(tmp_path):
+    shared_dir = str(tmp_path / "shared")
+    caches = []
+    for name in ("kitchen", "lounge"):
+        (tmp_path / name).mkdir()
+        caches.append(brainz_lib.ArtCache(str(tmp_path / name), shared_dir=shared_dir))
+    kitchen, lounge = (
+        brainz_lib.Brainz(cache_dir=cache._cache_dir, cache=cache) for cache in caches
+    )
+
+    try:
+        with mock.patch.object(
+            brainz_lib.Brainz, "request_album_art", return_value=b"cover"
+        ) as request:
+            kitchen.get_album_art("Artist", "Album")
+            # As if the lookup was queued before kitchen cached the art
+            path = lounge._submit(
+                "Artist_Album", lounge._fetch_album_art, "Artist", "Album"
+            ).result(5)
+    finally:
+        kitchen.shutdown()
+        lounge.shutdown()
+
+    request.assert_called_once()
+    with open(path, "rb") as f:
+        assert f.read() == b"cover"
+
+
+def test_default_art_is_only_written_once(tmp_path):
+    (tmp_path / "__default.jpg").write_bytes(b"old default art")
+    brainz_lib.Brainz(cache_dir=str(tmp_path)).shutdown()
+
+    with mock.patch.object(brainz_lib.Brainz, "save_album_art") as save:
+        brainz = brainz_lib.Brainz(cache_dir=str(tmp_path))
+        brainz.shutdown()
+
+    save.assert_not_called()
+    assert [p.name for p in tmp_path.glob("__default*")] == [
+        os.path.basename(brainz._default_filename)
+    ]
+
+
+def test_get_file_art_extracts_embedded_art(brainz, tmp_path):
+    track = tmp_path / "track.mp3"
+    track.write_bytes(b"")
+
+    with mock.patch.object(
+        brainz_lib.local, "read_embedded_art", return_value=b"cover"
+    ):
+        file_name = brainz.get_file_art(str(track))
+    with mock.patch.object(brainz_lib.local, "read_embedded_art", return_value=None):
+        no_art = brainz.get_file_art(str(tmp_path / "other.mp3"))
+
+    with open(file_name, "rb") as f:
+        assert f.read() == b"cover"
+    assert no_art is None
+
+
+def test_musicbrainz_backoff_does_not_hold_up_other_art(brainz, tmp_path):
+    release = threading.Event()
+    track = tmp_path / "track.flac"
+    track.write_bytes(b"")
+
+    def request_album_art(artist, album, size=None):
+        # Backing off while the network is down
+        release.wait(5)
+        return None
+
+    with mock.patch.object(
+        brainz, "request_album_art", side_effect=request_album_art
+    ), mock.patch.object(brainz_lib.local, "read_embedded_art", return_value=b"cover"):
+        lookups = [
+            brainz.get_album_art(f"Artist {i}", "Album", callback=lambda f: None)
+            for i in range(brainz.max_workers)
+        ]
+        try:
+            file_art = brainz.get_file_art(str(track), callback=lambda f: None)
+            assert file_art.result(5) == brainz.get_cache_file_name(str(track))
+        finally:
+            release.set()
+
+    for lookup in lookups:
+        assert lookup.result(5) == brainz._default_filename
@@ -0,0 +1,295 @@
+import os
+import threading
+from unittest import mock
+
+import pytest
+from mopidy_pidi import cache as cache_lib
+
+
+@pytest.fixture
+def art_cache(tmp_path):
+    return cache_lib.ArtCache(str(tmp_path))
+
+
+def test_get_missing_key_is_a_miss(art_cache):
+    assert art_cache.get("Artist_Album") is None
+
+
+def test_put_then_get(art_cache):
+    path = art_cache.put("Artist_Album", b"cover")
+
+    assert art_cache.get("Artist_Album") == path
+    with open(path, "rb") as f:
+        assert f.read() == b"cover"
+
+
+def test_file_name_is_path_safe(art_cache):
+    # b64encode("??>") == "Pz8+" and b64encode("???") == "Pz8/"
+    assert "/" not in art_cache.get_file_name("???")
+
+
+def test_evicts_least_recently_used_entry(tmp_path):
+    art_cache = cache_lib.ArtCache(str(tmp_path), max_entries=2)
+    first = art_cache.put("first", b"1")
+    art_cache.put("second", b"2")
+    art_cache.get("first")
+
+    art_cache.put("third", b"3")
+
+    assert "second" not in art_cache
+    assert art_cache.get("first") == first
+    assert not (tmp_path / art_cache.get_file_name("second")).exists()
+
+
+def test_evicts_to_byte_limit(tmp_path):
+    art_cache = cache_lib.ArtCache(str(tmp_path), max_bytes=10)
+    art_cache.put("first", b"123456")
+    art_cache.put("second", b"123456")
+
+    assert len(art_cache) == 1
+    assert art_cache.total_bytes == 6
+
+
+def test_index_is_persisted(tmp_path):
+    art_cache = cache_lib.ArtCache(str(tmp_path))
+    path = art_cache.put("Artist_Album", b"cover")
+
+    reloaded = cache_lib.ArtCache(str(tmp_path))
+
+    assert reloaded.get("Artist_Album") == path
+    assert reloaded.total_bytes == len(b"cover")
+
+
+def test_index_is_saved_in_batches(tmp_path):
+    art_cache = cache_lib.ArtCache(str(tmp_path))
+    art_cache.max_unsaved_changes = 3
+
+    with mock.patch.object(
+        art_cache, "_save_index", wraps=art_cache._save_index
+    ) as save_index:
+        art_cache.put("Artist_Album", b"cover")
+        art_cache.add_miss("Other_Album", ttl=60)
+        assert save_index.call_count == 0
+
+        art_cache.put("Another_Album", b"cover")
+        assert save_index.call_count == 1
+
+        art_cache.flush()
+        assert save_index.call_count == 1
+
+        art_cache.add_miss("Last_Album", ttl=60)
+        art_cache.flush()
+        assert save_index.call_count == 2
+
+
+def test_art_stored_since_the_index_was_saved_is_kept(tmp_path):
+    art_cache = cache_lib.ArtCache(str(tmp_path))
+    art_cache.put("Artist_Album", JPEG)
+    art_cache.flush()
+    art_cache.put("Other_Album", JPEG)
+    art_cache.discard("Artist_Album")
+
+    # Without a clean shutdown
+    reloaded = cache_lib.ArtCache(str(tmp_path))
+
+    assert "Other_Album" in reloaded
+    assert "Artist_Album" not in reloaded
+    assert reloaded.total_bytes == len(JPEG)
+    assert not (tmp_path / reloaded.quarantine_name).exists()
+
+
+def test_index_is_rebuilt_from_existing_art(tmp_path):
+    art_cache = cache_lib.ArtCache(str(tmp_path))
+    (tmp_path / art_cache.get_file_name("Artist_Album")).write_bytes(b"cover")
+    (tmp_path / art_cache.index_name).unlink()
+
+    rebuilt = cache_lib.ArtCache(str(tmp_path))
+
+    assert "Artist_Album" in rebuilt
+
+
+def test_miss_expires(art_cache):
+    art_cache.add_miss("Artist_Album", ttl=60)
+    assert art_cache.is_miss("Artist_Album")
+
+    art_cache.add_miss("Artist_Album", ttl=0)
+    assert not art_cache.is_miss("Artist_Album")
+
+
+def test_misses_are_persisted(tmp_path):
+    art_cache = cache_lib.ArtCache(str(tmp_path))
+    art_cache.add_miss("Artist_Album", ttl=60)
+    art_cache.flush()
+
+    assert cache_lib.ArtCache(str(tmp_path)).is_miss("Artist_Album")
+
+
+def test_expired_misses_keep_their_source(art_cache):
+    art_cache.add_miss("Artist_Album", ttl=0, source=["Artist", "Album"])
+    art_cache.add_miss("Other_Album", ttl=60, source=["Other", "Album"])
+
+    assert art_cache.get_expired_misses() == [("Artist_Album", ["Artist", "Album"])]
+
+
+def test_put_clears_miss(art_cache):
+    art_cache.add_miss("Artist_Album", ttl=60)
+
+    art_cache.put("Artist_Album", b"cover")
+
+    assert not art_cache.is_miss("Artist_Album")
+
+
+def test_write_file_leaves_no_temporary_files(tmp_path):
+    cache_lib.write_file(str(tmp_path / "art.jpg"), b"cover")
+
+    assert [p.name for p in tmp_path.iterdir()] == ["art.jpg"]
+
+
+@pytest.fixture
+def shared_caches(tmp_path):
+    shared = tmp_path / "shared"
+    caches = []
+    for name in ("kitchen", "lounge"):
+        (tmp_path / name).mkdir()
+        caches.append(
+            cache_lib.ArtCache(
+                str(tmp_path / name), max_entries=1, shared_dir=str(shared)
+            )
+        )
+    return shared, caches
+
+
+def test_shared_art_is_stored_once(shared_caches):
+    shared, (kitchen, lounge) = shared_caches
+
+    kitchen.put("Artist_Album", b"cover")
+    path = lounge.get("Artist_Album")
+
+    with open(path, "rb") as f:
+        assert f.read() == b"cover"
+    assert "Artist_Album" in lounge
+    assert len(list((shared / "blobs").iterdir())) == 1
+
+
+def test_identical_art_shares_a_blob(shared_caches):
+    shared, (kitchen, lounge) = shared_caches
+
+    kitchen.put("Artist_Album", b"cover")
+    lounge.put("Artist_Album (Deluxe)", b"cover")
+
+    assert len(list((shared / "blobs").iterdir())) == 1
+
+
+def test_shared_art_is_deleted_once_unused(shared_caches):
+    shared, (kitchen, lounge) = shared_caches
+    kitchen.put("Artist_Album", b"cover")
+    lounge.get("Artist_Album")
+
+    kitchen.put("Other_Album", b"other")
+    assert len(list((shared / "blobs").iterdir())) == 2
+
+    lounge.put("Third_Album", b"third")
+    assert lounge.get("Artist_Album") is None
+    assert len(list((shared / "blobs").iterdir())) == 2
+
+
+def test_shared_lock_is_held_across_caches(shared_caches):
+    _, (kitchen, lounge) = shared_caches
+    pytest.importorskip("fcntl")
+    acquired = threading.Event()
+
+    def fetch():
+        with lounge.lock("Artist_Album"):
+            acquired.set()
+
+    with kitchen.lock("Artist_Album"):
+        thread = threading.Thread(target=fetch)
+        thread.start()
+        assert not acquired.wait(0.1)
+
+    thread.join()
+    assert acquired.is_set()
+
+
+JPEG = cache_lib.JPEG_START + b"cover" + cache_lib.JPEG_END
+
+
+def test_is_complete(tmp_path):
+    path = tmp_path / "art.jpg"
+
+    path.write_bytes(JPEG)
+    assert cache_lib.is_complete(str(path), len(JPEG))
+    assert not cache_lib.is_complete(str(path), len(JPEG) + 1)
+
+    path.write_bytes(JPEG[:-1])
+    assert not cache_lib.is_complete(str(path))
+
+    path.write_bytes(cache_lib.PNG_START + b"cover")
+    assert not cache_lib.is_complete(str(path))
+
+    assert not cache_lib.is_complete(str(tmp_path / "missing.jpg"))
+
+
+def test_truncated_art_is_quarantined_on_read(tmp_path):
+    art_cache = cache_lib.ArtCache(str(tmp_path))
+    path = art_cache.put("Artist_Album", JPEG)
+    with open(path, "r+b") as f:
+        f.truncate(len(JPEG) // 2)
+
+    assert art_cache.get("Artist_Album") is None
+    assert "Artist_Album" not in art_cache
+    assert (
+        tmp_path / art_cache.quarantine_name / art_cache.get_file_name("Artist_Album")
+    ).exists()
+
+
+def test_corrupt_art_is_quarantined_after_unclean_shutdown(tmp_path):
+    art_cache = cache_lib.ArtCache(str(tmp_path))
+    path = art_cache.put("Artist_Album", JPEG)
+    art_cache.put("Other_Album", JPEG)
+    with open(path, "wb") as f:
+        f.write(JPEG[:4])
+
+    reloaded = cache_lib.ArtCache(str(tmp_path))
+
+    assert "Artist_Album" not in reloaded
+    assert "Other_Album" in reloaded
+
+
+def test_clean_shutdown_skips_startup_check(tmp_path):
+    art_cache = cache_lib.ArtCache(str(tmp_path))
+    art_cache.put("Artist_Album", JPEG)
+    art_cache.close()
+
+    with mock.patch.object(cache_lib, "is_complete") as is_complete:
+        reloaded = cache_lib.ArtCache(str(tmp_path))
+
+    is_complete.assert_not_called()
+    assert "Artist_Album" in reloaded
+
+
+def test_cache_changed_after_a_clean_start_is_checked_again(tmp_path):
+    art_cache = cache_lib.ArtCache(str(tmp_path))
+    art_cache.put("Artist_Album", JPEG)
+    art_cache.close()
+
+    restarted = cache_lib.ArtCache(str(tmp_path))
+    restarted.put("Other_Album", JPEG)
+
+    # Without a clean shutdown
+    reloaded = cache_lib.ArtCache(str(tmp_path))
+
+    assert "Artist_Album" in reloaded
+    assert "Other_Album" in reloaded
+
+
+def test_unfinished_writes_are_deleted(tmp_path):
+    art_cache = cache_lib.ArtCache(str(tmp_path))
+    path = art_cache.put("Artist_Album", JPEG)
+    temp_file = tmp_path / f"{os.path.basename(path)}.1234.5678.tmp"
+    temp_file.write_bytes(JPEG[:4])
+
+    reloaded = cache_lib.ArtCache(str(tmp_path))
+
+    assert not temp_file.exists()
+    assert "Artist_Album" in reloaded
@@ -0,0 +1,70 @@
+from unittest import mock
+
+import pykka
+from mopidy.models import Album, Artist, Image, Ref, Track
+
+from mopidy_pidi import commands as commands_lib
+from mopidy_pidi import frontend as frontend_lib
+
+
+def resolved(value):
+    future = pykka.ThreadingFuture()
+    future.set(value)
+    return future
+
+
+def test_warm_cache_fetches_art_once_per_album():
+    tracks = {
+        f"dummy:track:{i}": Track(
+            uri=f"dummy:track:{i}",
+            name=f"Track {i}",
+            artists=[Artist(name="Artist")],
+            album=Album(name=f"Album {i // 2}"),
+        )
+        for i in range(4)
+    }
+    library = mock.Mock()
+    library.browse.side_effect = lambda uri: resolved(
+        [Ref.directory(uri="dummy:directory", name="Directory")]
+        if uri is None
+        else [Ref.track(uri=uri, name=track.name) for uri, track in tracks.items()]
+    )
+    library.lookup.side_effect = lambda uris: resolved(
+        {uri: [tracks[uri]] for uri in uris}
+    )
+    library.get_images.side_effect = lambda uris: resolved(
+        {uri: [Image(uri="https://example.com/cover.jpg")] for uri in uris}
+    )
+    brainz = mock.Mock()
+    brainz.get_url_art.return_value = "/tmp/cover.jpg"
+    brainz.is_default_art.return_value = False
+
+    found, total = commands_lib.WarmCacheCommand().warm_cache(
+        library, brainz, frontend_lib.PiDiConfig({})
+    )
+
+    assert (found, total) == (2, 2)
+    assert brainz.get_url_art.call_count == 2
+    brainz.get_album_art.assert_not_called()
+
+
+def test_warm_cache_falls_back_to_musicbrainz():
+    track = Track(
+        uri="dummy:track",
+        name="Track",
+        artists=[Artist(name="Artist")],
+        album=Album(name="Album"),
+    )
+    library = mock.Mock()
+    library.browse.return_value = resolved([Ref.album(uri="dummy:album")])
+    library.lookup.return_value = resolved({"dummy:album": [track]})
+    library.get_images.return_value = resolved({"dummy:track": []})
+    brainz = mock.Mock()
+    brainz.is_default_art.return_value = True
+
+    found, total = commands_lib.WarmCacheCommand().warm_cache(
+        library, brainz, frontend_lib.PiDiConfig({})
+    )
+
+    assert (found, total) == (0, 1)
+    brainz.get_album_art.assert_called_once_with("Artist", "Album")
@@ -0,0 +1,71 @@
+import threading
+from unittest import mock
+
+import pytest
+from mopidy_pidi import events as events_lib
+
+
+@pytest.fixture
+def deferred():
+    calls = []
+    done = threading.Event()
+
+    def run(fn, args):
+        calls.append(args)
+        fn(*args)
+        done.set()
+
+    return calls, done, run
+
+
+def test_call_runs_first_call_immediately_and_coalesces_the_rest(deferred):
+    calls, done, run = deferred
+    events = events_lib.Coalescer(run, window=0.05)
+    fn = mock.Mock()
+
+    for volume in range(10):
+        events.call("volume", fn, volume)
+
+    fn.assert_called_once_with(0)
+    assert done.wait(1)
+    events.cancel_all()
+    assert calls == [(9,)]
+    assert fn.call_args_list == [mock.call(0), mock.call(9)]
+
+
+def test_debounce_waits_for_calls_to_settle(deferred):
+    calls, done, run = deferred
+    events = events_lib.Coalescer(run)
+    fn = mock.Mock()
+
+    for track in range(10):
+        events.debounce("track", 0.05, fn, track)
+
+    fn.assert_not_called()
+    assert done.wait(1)
+    fn.assert_called_once_with(9)
+
+
+def test_flush_makes_pending_call_now(deferred):
+    calls, done, run = deferred
+    events = events_lib.Coalescer(run)
+    fn = mock.Mock()
+
+    events.debounce("track", 10, fn, "track")
+    events.flush("track")
+    events.flush("track")
+
+    fn.assert_called_once_with("track")
+    assert calls == []
+
+
+def test_cancel_drops_pending_call(deferred):
+    calls, done, run = deferred
+    events = events_lib.Coalescer(run)
+    fn = mock.Mock()
+
+    events.debounce("track", 0.01, fn, "track")
+    events.cancel("track")
+
+    assert not done.wait(0.1)
+    fn.assert_not_called()
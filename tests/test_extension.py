@@ -1,5 +1,9 @@
 from unittest import mock
 
+from mopidy import exceptions
+
+import mopidy_pidi
+import pytest
 from mopidy_pidi import Extension
 from mopidy_pidi import frontend as frontend_lib
 
@@ -19,6 +23,9 @@ def test_get_config_schema():
     schema = ext.get_config_schema()
 
     assert "display" in schema
+    assert "min_fps" in schema
+    assert "max_fps" in schema
+    assert "cache_max_mb" in schema
 
 
 def test_setup():
@@ -28,3 +35,43 @@ def test_setup():
     ext.setup(registry)
 
     registry.add.assert_called_once_with("frontend", frontend_lib.PiDiFrontend)
+
+
+def test_get_display_class_only_loads_selected_plugin():
+    selected = mock.Mock()
+    selected.load.return_value.option_name = "selected"
+    other = mock.Mock()
+    entry_points = {"selected": selected, "other": other}
+    Extension.get_display_class.cache_clear()
+
+    with mock.patch.object(
+        mopidy_pidi, "get_display_entry_points", return_value=entry_points
+    ):
+        display_class = Extension.get_display_class("selected")
+
+    Extension.get_display_class.cache_clear()
+    assert display_class is selected.load.return_value
+    other.load.assert_not_called()
+
+
+def test_get_command():
+    ext = Extension()
+
+    command = ext.get_command()
+
+    assert "warm-cache" in command._children
+
+
+def test_get_display_class_rejects_unknown_plugin():
+    selected = mock.Mock()
+    selected.load.return_value.option_name = "selected"
+    Extension.get_display_class.cache_clear()
+    Extension.get_display_types.cache_clear()
+
+    with mock.patch.object(
+        mopidy_pidi, "get_display_entry_points", return_value={"selected": selected}
+    ), pytest.raises(exceptions.ExtensionError, match="choose from: selected"):
+        Extension.get_display_class("typo")
+
+    Extension.get_display_class.cache_clear()
+    Extension.get_display_types.cache_clear()
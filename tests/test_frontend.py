@@ -1,9 +1,14 @@
-import pkg_resources
+import time
+from unittest import mock
+
 import pykka
 from mopidy import core
+from mopidy.models import Album, Image, Track
 
+import mopidy_pidi
 import pytest
 from mopidy_pidi import frontend as frontend_lib
+from mopidy_pidi import plugin as plugin_lib
 
 from . import dummy_audio, dummy_backend, dummy_mixer
 
@@ -18,22 +23,42 @@ def cleanup(request):
 
 
 @pytest.fixture
-def frontend():
+def audio():
+    return dummy_audio.create_proxy()
+
+
+@pytest.fixture
+def backend(audio):
+    return dummy_backend.create_proxy(audio=audio)
+
+
+@pytest.fixture
+def frontend(audio, backend):
+    config = {
+        "pidi": {"display": "dummy"},
+        "core": {"data_dir": "/tmp", "max_tracklist_length": 10000},
+    }
+
     mixer = dummy_mixer.create_proxy()
-    audio = dummy_audio.create_proxy()
-    backend = dummy_backend.create_proxy(audio=audio)
-    dummy_core = core.Core.start(audio=audio, mixer=mixer, backends=[backend]).proxy()
+    dummy_core = core.Core.start(
+        config=config, audio=audio, mixer=mixer, backends=[backend]
+    ).proxy()
 
-    distribution = pkg_resources.Distribution(__file__)
-    endpoint = pkg_resources.EntryPoint.parse(
-        "dummy = mopidy_pidi.plugin:DisplayDummy", dist=distribution
+    entry_point = mopidy_pidi.metadata.EntryPoint(
+        name="dummy",
+        value="mopidy_pidi.plugin:DisplayDummy",
+        group=mopidy_pidi.DISPLAY_ENTRY_POINT,
     )
-    distribution._ep_map = {"pidi.plugin.display": {"dummy": endpoint}}
-    pkg_resources.working_set.add(distribution, "dummy")
 
-    config = {"pidi": {"display": "dummy"}, "core": {"data_dir": "/tmp"}}
+    with mock.patch.object(
+        mopidy_pidi, "get_display_entry_points", return_value={"dummy": entry_point}
+    ):
+        frontend = frontend_lib.PiDiFrontend(config, dummy_core)
+        yield frontend
 
-    return frontend_lib.PiDiFrontend(config, dummy_core)
+    # Stop the render thread even if the test failed part way through
+    if getattr(frontend, "display", None) is not None:
+        frontend.on_stop()
 
 
 def test_on_start(frontend):
@@ -45,3 +70,307 @@ def test_options_changed(frontend):
     frontend.on_start()
     frontend.options_changed()
     frontend.on_stop()
+
+
+def test_update_marks_only_changed_regions_dirty(frontend):
+    display = frontend_lib.PiDi(frontend.config)
+    display._take_dirty()
+
+    display.update(title="Title", elapsed=0.0)
+    assert display._take_dirty() == {plugin_lib.REGION_TEXT}
+
+    display.update(title="Title")
+    assert display._take_dirty() == set()
+
+    display.update(shuffle=True)
+    assert display._take_dirty() == {plugin_lib.REGION_STATE}
+
+
+def test_progress_pixel_tracks_display_size(frontend):
+    display = frontend_lib.PiDi(frontend.config)
+    display.update(elapsed=30000.0, length=60000.0)
+
+    assert display._get_progress_pixel() == display.display_config.size // 2
+
+
+def test_frame_delay_follows_progress_pixel(frontend):
+    display = frontend_lib.PiDi(frontend.config)
+    display.idle_timeout = 0
+    # A ten minute track moves the 240px progress bar every 2.5 seconds
+    display.update(state="play", elapsed=0.0, length=600000.0)
+
+    # Allow for the track playing on while the test runs
+    assert display._get_frame_delay() == pytest.approx(2.5, abs=0.01)
+
+    display.update(elapsed=0.0, length=1000.0)
+    assert display._get_frame_delay() == pytest.approx(1.0 / display.max_fps)
+
+
+def test_frame_delay_when_stopped_uses_min_fps(frontend):
+    display = frontend_lib.PiDi(frontend.config)
+    display.idle_timeout = 0
+
+    assert display._get_frame_delay() == pytest.approx(1.0 / display.min_fps)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_idle_display_sleeps_until_state_changes(frontend):
+    display = frontend_lib.PiDi(frontend.config)
+    display.idle_timeout = 1
+    panel = display._display
+
+    with mock.patch.object(panel, "start") as start, mock.patch.object(
+        panel, "stop"
+    ) as stop, mock.patch.object(
+        display, "_render_frame", wraps=display._render_frame
+    ) as render_frame:
+        # Nothing has happened for longer than the idle timeout
+        display.start()
+        try:
+            assert wait_for(lambda: stop.called)
+            frames = render_frame.call_count
+
+            display.update(title="Title", elapsed=0.0)
+            time.sleep(0.2)
+            assert render_frame.call_count == frames
+            assert stop.call_count == 1
+
+            display.update(volume=50)
+            assert wait_for(lambda: render_frame.call_count > frames)
+            assert start.call_count == 2
+            assert panel.damage[-1] == plugin_lib.ALL_REGIONS
+        finally:
+            display.stop()
+
+
+def test_stale_album_art_is_not_decoded(frontend):
+    display = frontend_lib.PiDi(frontend.config)
+    display._art_generation = 2
+    display._art_images = None
+
+    with mock.patch.object(display._display, "update_album_art") as update:
+        display._handle_album_art("/tmp/old.jpg", generation=1)
+        display._handle_album_art("/tmp/new.jpg", generation=2)
+
+    update.assert_called_once_with("/tmp/new.jpg")
+
+
+def test_recent_album_art_is_not_decoded_again(frontend, tmp_path):
+    pil_image = pytest.importorskip("PIL.Image")
+    covers = []
+    for colour in ("red", "blue"):
+        cover = str(tmp_path / f"{colour}.jpg")
+        pil_image.new("RGB", (240, 240), colour).save(cover)
+        covers.append(cover)
+    display = frontend_lib.PiDi(frontend.config)
+
+    with mock.patch.object(
+        frontend_lib.image, "load_album_art", wraps=frontend_lib.image.load_album_art
+    ) as load, mock.patch.object(display._display, "update_album_art_image") as update:
+        for cover in covers + covers:
+            display._handle_album_art(cover)
+
+    assert load.call_count == 2
+    assert update.call_count == 4
+
+
+def test_art_image_cache_fits_covers_at_display_size(frontend):
+    pil_image = pytest.importorskip("PIL.Image")
+    init = plugin_lib.DisplayDummy.__init__
+
+    def init_large_display(display, args):
+        init(display, args)
+        args.size = 480
+
+    with mock.patch.object(plugin_lib.DisplayDummy, "__init__", init_large_display):
+        display = frontend_lib.PiDi(frontend.config)
+    for i in range(display.art_image_cache_covers):
+        display._art_images.put(i, pil_image.new("RGB", (480, 480)))
+
+    assert len(display._art_images) == display.art_image_cache_covers
+
+
+def test_progress_ignores_zero_length():
+    state = frontend_lib.DisplayState(state="play", elapsed=1000.0, length=0)
+
+    assert state.get_progress(state.elapsed_at + 1) == 0
+
+
+def test_update_swaps_in_a_new_state(frontend):
+    display = frontend_lib.PiDi(frontend.config)
+    old_state = display._state
+
+    display.update(title="Title", artist="Artist")
+    display.update(title="Title")
+
+    assert old_state.title == ""
+    assert display._state.version == old_state.version + 1
+    assert (display._state.title, display._state.artist) == ("Title", "Artist")
+    with pytest.raises(AttributeError):
+        display._state.title = "Other"
+
+
+def test_progress_tick_only_redraws_progress(frontend):
+    display = frontend_lib.PiDi(frontend.config)
+    # One pixel of the 240px progress bar per second
+    display.update(state="play", elapsed=0.0, length=240000.0)
+    display._render_frame()
+    assert display._display.damage == [plugin_lib.ALL_REGIONS]
+
+    display._state = display._state._replace(elapsed_at=display._state.elapsed_at - 2)
+    display._render_frame()
+
+    assert display._display.damage[1:] == [frozenset([plugin_lib.REGION_PROGRESS])]
+
+
+def add_tracks(frontend, backend, count):
+    tracks = [
+        Track(uri=f"dummy:{i}", name=f"Track {i}", album=Album(name=f"Album {i}"))
+        for i in range(count)
+    ]
+    backend.library.dummy_library = tracks
+    return frontend.core.tracklist.add(uris=[track.uri for track in tracks]).get()
+
+
+def test_prefetch_art_warms_upcoming_tracks(frontend, backend):
+    frontend.on_start()
+    tl_tracks = add_tracks(frontend, backend, 5)
+
+    with mock.patch.object(frontend.display, "prefetch_album_art") as prefetch:
+        frontend.prefetch_art(tl_tracks[0])
+
+    assert [c.args[1] for c in prefetch.call_args_list] == [
+        "Album 1",
+        "Album 2",
+        "Album 3",
+    ]
+
+
+def test_upcoming_tracks_wrap_around_on_repeat(frontend, backend):
+    tl_tracks = add_tracks(frontend, backend, 3)
+
+    assert frontend.get_upcoming_tracks(tl_tracks[1], 3) == [tl_tracks[2].track]
+
+    frontend.core.tracklist.set_repeat(True).get()
+    assert frontend.get_upcoming_tracks(tl_tracks[1], 3) == [
+        tl_tracks[2].track,
+        tl_tracks[0].track,
+        tl_tracks[1].track,
+    ]
+
+
+def test_get_art_uri_picks_smallest_covering_image(frontend):
+    frontend.on_start()
+    images = [
+        Image(uri="1000.jpg", width=1000, height=1000),
+        Image(uri="64.jpg", width=64, height=64),
+        Image(uri="300.jpg", width=300, height=300),
+        Image(uri="640.jpg", width=640, height=640),
+    ]
+
+    art = frontend.get_art_uri(images)
+
+    frontend.on_stop()
+    assert art == "300.jpg"
+
+
+def test_get_art_uri_falls_back_to_largest_image(frontend):
+    frontend.on_start()
+    images = [
+        Image(uri="unknown.jpg"),
+        Image(uri="64.jpg", width=64, height=64),
+        Image(uri="120.jpg", width=120, height=120),
+    ]
+
+    art = frontend.get_art_uri(images)
+    unknown_art = frontend.get_art_uri([Image(uri="unknown.jpg")])
+    no_art = frontend.get_art_uri(())
+
+    frontend.on_stop()
+    assert art == "120.jpg"
+    assert unknown_art == "unknown.jpg"
+    assert no_art is None
+
+
+def test_get_local_art_finds_cover_alongside_track(frontend, tmp_path):
+    track = tmp_path / "track.mp3"
+    track.write_bytes(b"")
+    (tmp_path / "cover.jpg").write_bytes(b"cover")
+
+    assert frontend.get_local_art(track.as_uri()) == str(tmp_path / "cover.jpg")
+    assert frontend.get_local_art("dummy:track") is None
+
+
+def test_pause_applies_pending_track_start(frontend):
+    frontend.on_start()
+
+    with mock.patch.object(frontend, "start_track") as start_track:
+        frontend.track_playback_started(4)
+        frontend.track_playback_paused(4, 0)
+
+    start_track.assert_called_once_with(4)
+
+
+@pytest.fixture
+def frontend_actor(frontend):
+    """A started frontend, to which deferred event handlers are delivered."""
+    actor_ref = frontend_lib.PiDiFrontend.start(frontend.config, frontend.core)
+    yield actor_ref.proxy()
+    actor_ref.stop()
+
+
+def test_seek_after_track_start_is_kept(frontend_actor, frontend, backend):
+    track = add_tracks(frontend, backend, 1)[0]
+
+    frontend_actor.track_playback_started(track)
+    frontend_actor.seeked(30000)
+    time.sleep(frontend.track_settle_delay * 2)
+
+    assert frontend_actor.display.get()._state.elapsed == 30000.0
+
+
+def test_stream_title_after_track_start_is_kept(frontend_actor, frontend, backend):
+    track = add_tracks(frontend, backend, 1)[0]
+
+    frontend_actor.track_playback_started(track)
+    frontend_actor.stream_title_changed("Stream Title")
+    time.sleep(frontend.track_settle_delay * 2)
+
+    assert frontend_actor.display.get()._state.title == "Stream Title"
+
+
+def test_skipping_tracks_only_starts_the_last(frontend_actor, frontend, backend):
+    tl_tracks = add_tracks(frontend, backend, 5)
+
+    with mock.patch.object(
+        frontend_lib.PiDiFrontend, "start_track", autospec=True
+    ) as start_track, mock.patch.object(
+        frontend_lib.PiDiFrontend, "end_track", autospec=True
+    ) as end_track:
+        frontend_actor.track_playback_started(tl_tracks[0])
+        # The core ends each track just before starting the next
+        for previous, tl_track in zip(tl_tracks, tl_tracks[1:]):
+            frontend_actor.track_playback_ended(previous, 1000)
+            frontend_actor.track_playback_started(tl_track)
+        time.sleep(frontend.track_settle_delay * 2)
+
+    assert [c.args[1] for c in start_track.call_args_list] == [tl_tracks[-1]]
+    end_track.assert_not_called()
+
+
+def test_end_of_playback_is_shown(frontend_actor, frontend, backend):
+    tl_track = add_tracks(frontend, backend, 1)[0]
+
+    frontend_actor.track_playback_started(tl_track)
+    time.sleep(frontend.track_settle_delay * 2)
+    frontend_actor.track_playback_ended(tl_track, 5000)
+    time.sleep(frontend.track_settle_delay * 2)
+
+    state = frontend_actor.display.get()._state
+    assert (state.state, state.elapsed) == ("pause", 5000.0)
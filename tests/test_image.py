@@ -0,0 +1,46 @@
+import io
+
+import pytest
+from mopidy_pidi import image as image_lib
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def encode(image, format="PNG"):
+    output = io.BytesIO()
+    image.save(output, format=format)
+    return output.getvalue()
+
+
+def test_get_thumbnail_size():
+    assert image_lib.get_thumbnail_size(240) == 250
+    assert image_lib.get_thumbnail_size(320) == 500
+    assert image_lib.get_thumbnail_size(2000) is None
+
+
+def test_prepare_album_art_resizes_to_display():
+    data = encode(Image.new("RGB", (500, 500), "red"))
+
+    prepared = image_lib.prepare_album_art(data, 240, blur=True)
+
+    with Image.open(io.BytesIO(prepared)) as image:
+        assert image.size == (240, 240)
+        assert image.format == "JPEG"
+
+
+def test_prepare_album_art_passes_through_bad_data():
+    assert image_lib.prepare_album_art(b"not an image", 240) == b"not an image"
+
+
+def test_image_cache_evicts_least_recently_used():
+    image_cache = image_lib.ImageCache(max_bytes=2 * 10 * 10 * 3)
+    first = Image.new("RGB", (10, 10))
+    image_cache.put("first", first)
+    image_cache.put("second", Image.new("RGB", (10, 10)))
+    image_cache.get("first")
+
+    image_cache.put("third", Image.new("RGB", (10, 10)))
+
+    assert image_cache.get("first") is first
+    assert image_cache.get("second") is None
+    assert len(image_cache) == 2
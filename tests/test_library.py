@@ -0,0 +1,68 @@
+from unittest import mock
+
+import pykka
+
+import pytest
+from mopidy_pidi import library as library_lib
+
+
+def get_images(uris):
+    future = pykka.ThreadingFuture()
+    future.set({uri: (f"{uri}.jpg",) for uri in uris})
+    return future
+
+
+@pytest.fixture
+def library():
+    library = mock.Mock()
+    library.get_images.side_effect = get_images
+    return library
+
+
+def test_get_images_is_batched(library):
+    library_images = library_lib.LibraryImages(library)
+
+    images = library_images.get_images(["dummy:a", "dummy:b"]).get()
+
+    assert images == {"dummy:a": ("dummy:a.jpg",), "dummy:b": ("dummy:b.jpg",)}
+    library.get_images.assert_called_once_with(["dummy:a", "dummy:b"])
+
+
+def test_get_images_is_memoized(library):
+    library_images = library_lib.LibraryImages(library)
+    library_images.get_images(["dummy:a"]).get()
+
+    images = library_images.get_images(["dummy:a", "dummy:b"]).get()
+
+    assert images["dummy:a"] == ("dummy:a.jpg",)
+    assert library.get_images.call_args_list == [
+        mock.call(["dummy:a"]),
+        mock.call(["dummy:b"]),
+    ]
+
+
+def test_pending_lookups_are_shared(library):
+    library_images = library_lib.LibraryImages(library)
+
+    first = library_images.get_images(["dummy:a"])
+    second = library_images.get_images(["dummy:a"])
+
+    assert first.get() == second.get()
+    library.get_images.assert_called_once_with(["dummy:a"])
+
+
+def test_expired_images_are_looked_up_again(library):
+    library_images = library_lib.LibraryImages(library, ttl=0)
+    library_images.get_images(["dummy:a"]).get()
+
+    library_images.get_images(["dummy:a"]).get()
+
+    assert library.get_images.call_count == 2
+
+
+def test_missing_uri_has_no_images(library):
+    library.get_images.side_effect = None
+    library.get_images.return_value = get_images([])
+    library_images = library_lib.LibraryImages(library)
+
+    assert library_images.get_images(["dummy:a"]).get() == {"dummy:a": ()}
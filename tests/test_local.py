@@ -0,0 +1,95 @@
+import pytest
+from mopidy_pidi import local as local_lib
+
+
+@pytest.fixture
+def album_dir(tmp_path):
+    album_dir = tmp_path / "Artist" / "Album"
+    album_dir.mkdir(parents=True)
+    (album_dir / "01 Track.flac").write_bytes(b"")
+    (album_dir / "02 Track.flac").write_bytes(b"")
+    return album_dir
+
+
+def test_get_track_path(tmp_path):
+    local_art = local_lib.LocalArt(media_dir=str(tmp_path))
+
+    assert local_art.get_track_path("file:///music/My%20Song.mp3") == (
+        "/music/My Song.mp3"
+    )
+    assert local_art.get_track_path("local:track:Artist/My%20Song.mp3") == str(
+        tmp_path / "Artist" / "My Song.mp3"
+    )
+    assert local_art.get_track_path("spotify:track:abc") is None
+
+
+def test_finds_cover_alongside_track(album_dir):
+    (album_dir / "Folder.jpg").write_bytes(b"folder")
+    (album_dir / "cover.jpg").write_bytes(b"cover")
+    local_art = local_lib.LocalArt()
+
+    art = local_art.find_art((album_dir / "01 Track.flac").as_uri())
+
+    assert art == str(album_dir / "cover.jpg")
+
+
+def test_art_is_cached_per_directory(album_dir, monkeypatch):
+    local_art = local_lib.LocalArt()
+    local_art.find_art((album_dir / "01 Track.flac").as_uri())
+    (album_dir / "cover.jpg").write_bytes(b"cover")
+
+    def scandir(path):
+        raise AssertionError("directory scanned again")
+
+    monkeypatch.setattr(local_lib.os, "scandir", scandir)
+
+    assert local_art.find_art((album_dir / "02 Track.flac").as_uri()) is None
+
+
+def test_finds_embedded_art(album_dir, monkeypatch):
+    track = album_dir / "01 Track.flac"
+    monkeypatch.setattr(
+        local_lib,
+        "read_embedded_art",
+        lambda path: b"cover" if path == str(track) else None,
+    )
+    local_art = local_lib.LocalArt()
+
+    assert local_art.find_art(track.as_uri()) == str(track)
+
+
+def test_reads_embedded_flac_picture(tmp_path):
+    flac = pytest.importorskip("mutagen.flac")
+    picture = flac.Picture()
+    picture.type = local_lib.PICTURE_TYPE_FRONT_COVER
+    picture.mime = "image/jpeg"
+    picture.data = b"cover"
+    path = tmp_path / "track.flac"
+    # A minimal FLAC stream: the marker and a final STREAMINFO block for
+    # 44.1kHz, stereo, 16 bit audio with no samples
+    stream_info = (
+        (4096).to_bytes(2, "big") * 2
+        + bytes(6)
+        + (44100 << 44 | 1 << 41 | 15 << 36).to_bytes(8, "big")
+        + bytes(16)
+    )
+    path.write_bytes(b"fLaC" + bytes([0x80, 0, 0, 34]) + stream_info)
+    audio = flac.FLAC(str(path))
+    audio.add_picture(picture)
+    audio.save()
+
+    assert local_lib.read_embedded_art(str(path)) == b"cover"
+
+
+def test_embedded_art_is_found_per_track(album_dir, monkeypatch):
+    first = album_dir / "01 Track.flac"
+    second = album_dir / "02 Track.flac"
+    embedded = {str(first): None, str(second): b"cover"}
+    monkeypatch.setattr(local_lib, "read_embedded_art", embedded.get)
+    local_art = local_lib.LocalArt()
+
+    assert local_art.find_art(first.as_uri()) is None
+    assert local_art.find_art(second.as_uri()) == str(second)
+
+    embedded[str(first)] = b"other cover"
+    assert local_art.find_art(first.as_uri()) == str(first)
@@ -0,0 +1,55 @@
+from mopidy_pidi import metrics as metrics_lib
+
+
+def test_histogram_buckets_observations():
+    registry = metrics_lib.Registry()
+    histogram = registry.histogram("redraw_seconds", "Redraws", buckets=(0.01, 0.1))
+
+    for value in (0.005, 0.05, 0.05, 1):
+        histogram.observe(value)
+
+    snapshot = registry.snapshot()["redraw_seconds"]
+    assert snapshot["count"] == 4
+    assert snapshot["sum"] == 1.105
+    assert list(snapshot["buckets"].values()) == [1, 2, 1]
+
+
+def test_registering_twice_returns_the_same_metric():
+    registry = metrics_lib.Registry()
+
+    assert registry.counter("frames", "Frames") is registry.counter("frames", "")
+
+
+def test_format_prometheus():
+    registry = metrics_lib.Registry()
+    registry.counter("frames_total", "Frames drawn").inc(3)
+    registry.histogram("redraw_seconds", "Redraws", buckets=(0.01,)).observe(0.5)
+
+    assert registry.format_prometheus() == (
+        "# HELP frames_total Frames drawn\n"
+        "# TYPE frames_total counter\n"
+        "frames_total 3\n"
+        "# HELP redraw_seconds Redraws\n"
+        "# TYPE redraw_seconds histogram\n"
+        'redraw_seconds_bucket{le="0.01"} 0\n'
+        'redraw_seconds_bucket{le="+Inf"} 1\n'
+        "redraw_seconds_sum 0.500000\n"
+        "redraw_seconds_count 1\n"
+    )
+
+
+def test_reporter_writes_textfile_and_summary(tmp_path, caplog):
+    registry = metrics_lib.Registry()
+    frames = registry.counter("pidi_frames_total", "Frames drawn")
+    textfile = tmp_path / "pidi.prom"
+    reporter = metrics_lib.Reporter(registry, 60, textfile=str(textfile))
+
+    frames.inc(30)
+    with caplog.at_level("INFO"):
+        reporter.report()
+
+    assert "pidi_frames_total 30" in textfile.read_text()
+    assert "fps" in caplog.text
+    assert reporter.format_summary(
+        registry.snapshot(), {"pidi_frames_total": 0}, 10
+    ).startswith("3.00 fps")